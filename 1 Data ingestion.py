@@ -24,30 +24,42 @@
 # MAGIC 
 # MAGIC We will be using [Databricks Notebooks workflow](https://docs.databricks.com/notebooks/notebook-workflows.html) element to set up environment for this exercise. 
 # MAGIC 
-# MAGIC `dbutils.notebook.run()` command will run another notebook and return its output to be used here.
+# MAGIC `dbutils.notebook.run()` command will run another notebook and return its output to be used here. `bootstrap` (see `Utils/Bootstrap`) runs the setup notebook this way only once and caches its output, so re-running notebooks on a warm cluster starts almost instantly.
 # MAGIC 
 # MAGIC `dbutils` has some other interesting uses such as interacting with file system or reading [Databricks Secrets](https://docs.databricks.com/dev-tools/databricks-utils.html#dbutils-secrets)
+# MAGIC 
+# MAGIC The `Provisioning` widget defaults to `full`, which drops and recreates the catalog and database on every run like before. Switch it to `incremental` to reuse the cached session and keep existing tables.
 
 # COMMAND ----------
 
 dbutils.widgets.dropdown("uc_status", "Enabled", ["Enabled", "Disabled"], "Unity Catalog")
+dbutils.widgets.dropdown("provisioning_mode", "full", ["full", "incremental"], "Provisioning")
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Bootstrap
 
 # COMMAND ----------
 
 uc_status= dbutils.widgets.get("uc_status")
 print("Unity Catalog : {}".format(uc_status))
 
-setup_responses = dbutils.notebook.run("./Utils/Setup-Batch", 0, {"uc_status": uc_status}).split()
+provisioning_mode = dbutils.widgets.get("provisioning_mode")
+print("Provisioning : {}".format(provisioning_mode))
+
+# full always runs Utils/Setup-Batch, incremental only when there is no cached session for this user yet
+session = bootstrap(uc_status, provisioning_mode)
 
-local_data_path = setup_responses[0]
-dbfs_data_path = setup_responses[1]
-database_name = setup_responses[2]
+local_data_path = session["local_data_path"]
+dbfs_data_path = session["dbfs_data_path"]
+dataset_path = session["dataset_path"]
+database_name = session["database_name"]
 
 
 print("Local data path is {}".format(local_data_path))
 print("DBFS path is {}".format(dbfs_data_path))
 if uc_status == 'Enabled':
-  catalog_name = setup_responses[3]
+  catalog_name = session["catalog_name"]
   print("Catalog name is {}".format(catalog_name))
   spark.sql(f"USE CATALOG {catalog_name};")
 print("Database name is {}".format(database_name))
@@ -71,7 +83,7 @@ spark.sql(f"USE {database_name};")
 # MAGIC 
 # MAGIC ***Load Store Locations data to Delta Table***
 # MAGIC 
-# MAGIC In our example CRM export has been provided to us as a CSV file and uploaded to `dbfs_data_path` location. It could also be your S3 bucket, Azure Storage account or Google Cloud Storage. 
+# MAGIC In our example CRM export has been provided to us as a CSV file and uploaded to the shared `dataset_path` location. It could also be your S3 bucket, Azure Storage account or Google Cloud Storage. 
 # MAGIC 
 # MAGIC We will not be looking at how to set up access to files on the cloud environment in today's workshop.
 # MAGIC 
@@ -83,7 +95,7 @@ spark.sql(f"USE {database_name};")
 
 # COMMAND ----------
 
-dataPath = f"{dbfs_data_path}/stores.csv"
+dataPath = f"{dataset_path}stores.csv"
 
 df = spark.read\
   .option("header", "true")\
@@ -126,6 +138,7 @@ df.createOrReplaceTempView("stores_csv_file")
 # MAGIC 
 # MAGIC CREATE TABLE stores
 # MAGIC USING DELTA
+# MAGIC TBLPROPERTIES (delta.enableDeletionVectors = true)
 # MAGIC AS
 # MAGIC SELECT * FROM stores_csv_file;
 # MAGIC 
@@ -138,6 +151,8 @@ df.createOrReplaceTempView("stores_csv_file")
 # MAGIC ### Update Delta Table
 # MAGIC 
 # MAGIC Provided dataset has address information, but no country name - let's add one!
+# MAGIC 
+# MAGIC The table was created with deletion vectors enabled, so an `UPDATE` does not rewrite the data files it touches - it marks the old rows as deleted and only writes the changed rows to a new file. `DESCRIBE HISTORY` shows `numDeletionVectorsAdded` in the operation metrics. `OPTIMIZE` or `REORG TABLE ... APPLY (PURGE)` rewrites the files later - the `5 Table Maintenance` job purges `stores` together with the sales tables.
 
 # COMMAND ----------
 
@@ -210,3 +225,36 @@ df.createOrReplaceTempView("stores_csv_file")
 # MAGIC %sql
 # MAGIC 
 # MAGIC select store_country, * from stores VERSION AS OF 2 where id = 'MEL02';
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Reading the transaction log directly
+# MAGIC 
+# MAGIC All of this metadata lives in the `_delta_log` folder next to the data files. For monitoring and maintenance jobs we do not need a Spark query to get it - `Utils/Delta-Log` parses the json commits and checkpoints with plain Python and returns history, active files, sizes and row counts (from file statistics) in milliseconds.
+# MAGIC 
+# MAGIC Note that the log has to be reachable from the driver, e.g. for tables stored on DBFS. Unity Catalog tables are stored on cloud storage, so with `uc_status` set to `Enabled` the cell below falls back to `DESCRIBE HISTORY`.
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Delta-Log
+
+# COMMAND ----------
+
+stores_path = delta_table_path("stores")
+
+# with Unity Catalog the table lives on cloud storage, which is not mounted on the driver
+if delta_log_readable(stores_path):
+  for commit in delta_history(stores_path):
+    print(commit["version"], commit.get("operation"))
+
+  print(delta_table_stats(delta_snapshot(stores_path)))
+  print(delta_table_stats(delta_snapshot(stores_path, version=2)))
+
+  # files added and removed by the last update - the touched file is removed and re-added with its deletion vector, next to a new file with the changed row
+  changed_files = delta_file_diff(stores_path, 2, 3)
+  print([f["path"] for f in changed_files["added"]], [f["path"] for f in changed_files["removed"]])
+else:
+  print(f"{stores_path} is not on DBFS - run with uc_status Disabled to read the log directly")
+  display(spark.sql("DESCRIBE HISTORY stores"))
@@ -38,24 +38,37 @@
 # MAGIC 
 # MAGIC We will be using [Databricks Notebooks workflow](https://docs.databricks.com/notebooks/notebook-workflows.html) element to set up environment for this exercise. 
 # MAGIC 
-# MAGIC `dbutils.notebook.run()` command will run another notebook and return its output to be used here.
+# MAGIC `dbutils.notebook.run()` command will run another notebook and return its output to be used here. `bootstrap` (see `Utils/Bootstrap`) runs the setup notebook this way only once and caches its output, so re-running notebooks on a warm cluster starts almost instantly.
 # MAGIC 
 # MAGIC `dbutils` has some other interesting uses such as interacting with file system (check our `dbutils.fs.rm()` being used in the next cell) or to read Secrets.
+# MAGIC 
+# MAGIC The `Provisioning` widget controls how the environment is set up. `full` drops the catalog, database and table files and rebuilds everything. `incremental` keeps them and only rebuilds objects whose source files or upstream tables changed since the last run (see `Utils/Provisioning`).
 
 # COMMAND ----------
 
 dbutils.widgets.dropdown("uc_status", "Enabled", ["Enabled", "Disabled"], "Unity Catalog")
+dbutils.widgets.dropdown("provisioning_mode", "full", ["full", "incremental"], "Provisioning")
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Bootstrap
 
 # COMMAND ----------
 
 uc_status= dbutils.widgets.get("uc_status")
 print("Unity Catalog : {}".format(uc_status))
 
-setup_responses = dbutils.notebook.run("./Utils/Setup-Batch", 0, {"uc_status": uc_status}).split()
+provisioning_mode = dbutils.widgets.get("provisioning_mode")
+print("Provisioning : {}".format(provisioning_mode))
+
+# runs Utils/Setup-Batch only when there is no cached session for this user or provisioning_mode is full
+session = bootstrap(uc_status, provisioning_mode)
 
-local_data_path = setup_responses[0]
-dbfs_data_path = setup_responses[1]
-database_name = setup_responses[2]
+local_data_path = session["local_data_path"]
+dbfs_data_path = session["dbfs_data_path"]
+# raw datasets are read from the cache shared by all users, see Utils/Dataset-Cache
+dataset_path = session["dataset_path"]
+database_name = session["database_name"]
 
 bronze_table_path = f"{dbfs_data_path}tables/bronze"
 silver_table_path = f"{dbfs_data_path}tables/silver"
@@ -64,14 +77,15 @@ gold_table_path = f"{dbfs_data_path}tables/gold"
 autoloader_ingest_path = f"{dbfs_data_path}/autoloader_ingest/"
 
 # Remove all files from location in case there were any
-dbutils.fs.rm(bronze_table_path, recurse=True)
-dbutils.fs.rm(silver_table_path, recurse=True)
-dbutils.fs.rm(gold_table_path, recurse=True)
+if provisioning_mode == 'full':
+  dbutils.fs.rm(bronze_table_path, recurse=True)
+  dbutils.fs.rm(silver_table_path, recurse=True)
+  dbutils.fs.rm(gold_table_path, recurse=True)
 
 print("Local data path is {}".format(local_data_path))
 print("DBFS path is {}".format(dbfs_data_path))
 if uc_status == 'Enabled':
-  catalog_name = setup_responses[3]
+  catalog_name = session["catalog_name"]
   print("Catalog name is {}".format(catalog_name))
   spark.sql(f"USE CATALOG {catalog_name};")
 print("Database name is {}".format(database_name))
@@ -90,123 +104,75 @@ spark.sql(f"USE DATABASE {database_name};")
 
 # COMMAND ----------
 
-# MAGIC %md
-# MAGIC # Delta Architecture
+# MAGIC %run ./Utils/Provisioning $provisioning_mode=$provisioning_mode
 
 # COMMAND ----------
 
-# MAGIC %md
-# MAGIC <img src="https://github.com/zivilenorkunaite/apjbootcamp2022/blob/main/images/APJuiceBootcampContext.png?raw=true" width=1012/>
+# MAGIC %run ./Utils/Table-Maintenance
 
 # COMMAND ----------
 
-# MAGIC %md
-# MAGIC ## Bronze Layer 
-# MAGIC 
-# MAGIC We have already seen the store locations dataset. Let's redo the work this time using suggested Delta Architecture steps
+# MAGIC %run ./Utils/Bronze-Ingest
 
 # COMMAND ----------
 
-spark.sql(f"USE DATABASE {database_name};")
-data_file_location = f"{dbfs_data_path}/stores.csv"
-
-bronze_table_name = "bronze_store_locations"
-silver_table_name = "dim_locations"
-
-df = spark.read\
-  .option("header", "true")\
-  .option("delimiter", ",")\
-  .option("inferSchema", "true")\
-  .csv(data_file_location)
-
-spark.sql(f"DROP TABLE IF EXISTS {bronze_table_name};")
+# MAGIC %run ./Utils/Backfill
 
-df.write \
-  .mode("overwrite") \
-  .saveAsTable(bronze_table_name)
-
-silver_df = spark.sql(f"""
-select *, 
-case when id in ('SYD01', 'MEL01', 'BNE02', 'MEL02', 'PER01', 'CBR01') then 'AUS' when id in ('AKL01', 'AKL02', 'WLG01') then 'NZL' end as country_code
-from {bronze_table_name}
-""")
-
-spark.sql(f"DROP TABLE IF EXISTS {silver_table_name};")
+# COMMAND ----------
 
+# MAGIC %run ./Utils/Dimension-Loader
 
-silver_df.write \
-  .mode("overwrite") \
-  .saveAsTable(silver_table_name)
+# COMMAND ----------
 
+# MAGIC %run ./Utils/Top-Customers
 
 # COMMAND ----------
 
-# MAGIC %md
-# MAGIC 
-# MAGIC We have 2 more dimension tables that can be added to the Lakehouse without many data changes - dim_customers and dim_products.
+# MAGIC %run ./Utils/Ingredients
 
 # COMMAND ----------
 
-data_file_location = f"{dbfs_data_path}/users.csv"
-
-bronze_table_name = "bronze_customers"
-silver_table_name = "dim_customers"
+# MAGIC %run ./Utils/Expectations
 
-df = spark.read\
-  .option("header", "true")\
-  .option("delimiter", ",")\
-  .option("inferSchema", "true")\
-  .csv(data_file_location)
+# COMMAND ----------
 
-spark.sql(f"DROP TABLE IF EXISTS {bronze_table_name};")
+# MAGIC %run ./Utils/Surrogate-Keys
 
-df.write \
-  .mode("overwrite") \
-  .saveAsTable(bronze_table_name)
+# COMMAND ----------
 
-silver_df = spark.sql(f"""
-SELECT store_id || "-" || cast(id as string) as unique_id, id, store_id, name, email FROM {bronze_table_name}
-""")
+# MAGIC %run ./Utils/Medallion-Stages
 
-spark.sql(f"DROP TABLE IF EXISTS {silver_table_name};")
+# COMMAND ----------
 
+# MAGIC %md
+# MAGIC # Delta Architecture
 
-silver_df.write \
-  .mode("overwrite") \
-  .saveAsTable(silver_table_name)
+# COMMAND ----------
 
+# MAGIC %md
+# MAGIC <img src="https://github.com/zivilenorkunaite/apjbootcamp2022/blob/main/images/APJuiceBootcampContext.png?raw=true" width=1012/>
 
 # COMMAND ----------
 
 # MAGIC %md
+# MAGIC ## Bronze Layer 
 # MAGIC 
-# MAGIC And repeat for dim_products - note that this time our input file is json and not csv
+# MAGIC We have already seen the store locations dataset. Let's redo the work this time using suggested Delta Architecture steps
+# MAGIC 
+# MAGIC We have 2 more dimension tables that can be added to the Lakehouse without many data changes - dim_customers and dim_products. All three follow the same bronze to silver steps, so we describe them in a config and let `load_dimensions` load them in parallel. A dimension is skipped when its source file has not changed since the last load.
+# MAGIC 
+# MAGIC These tables are small, so when DuckDB is installed their silver queries run on the driver instead of as Spark jobs (see `Utils/Local-Engine`). Queries stick to SQL both engines understand.
+# MAGIC 
+# MAGIC Store countries come from the small `store_countries` lookup table, which is broadcast to the join instead of being hard-coded in a `CASE` statement.
 
 # COMMAND ----------
 
-data_file_location = f"{dbfs_data_path}/products.json"
-
-bronze_table_name = "bronze_products"
-silver_table_name = "dim_products"
-
-df = spark.read\
-  .json(data_file_location)
-
-spark.sql(f"DROP TABLE IF EXISTS {bronze_table_name};")
-
-df.write \
-  .mode("overwrite") \
-  .saveAsTable(bronze_table_name)
-
-silver_df = spark.sql(f"""
-select * from {bronze_table_name}
-""")
+spark.sql(f"USE DATABASE {database_name};")
 
-spark.sql(f"DROP TABLE IF EXISTS {silver_table_name};")
+create_store_countries_table("store_countries")
 
-silver_df.write \
-  .mode("overwrite") \
-  .saveAsTable(silver_table_name)
+# the dimension configs (source files and silver queries) are in Utils/Medallion-Stages, shared with the 6 Daily Pipeline job
+load_dimensions(dimensions)
 
 # COMMAND ----------
 
@@ -224,48 +190,62 @@ silver_df.write \
 # MAGIC %md
 # MAGIC 
 # MAGIC Prepare for the first autoloader run - as this is an example Notebook, we can delete all the files and tables before running it.
+# MAGIC 
+# MAGIC In `incremental` provisioning mode the existing checkpoint and `bronze_sales` table are kept, so Autoloader only processes files it has not seen yet. When the landing zone or `bronze_sales` do not exist yet (e.g. the first scheduled run in a new workspace) they are set up as in a `full` run.
+# MAGIC 
+# MAGIC With `backfill_history` the historical month files are not copied to the landing zone - `run_backfill` loads each month with its own Autoloader job in parallel and merges them into `bronze_sales` in one commit (see `Utils/Backfill`). The stream then only picks up new files.
+# MAGIC 
+# MAGIC `SaleItems` is stored as a typed array instead of a JSON string - a `bronze_sales` table created with the string column needs one `full` run to be rebuilt.
 
 # COMMAND ----------
 
 import pyspark.sql.functions as F
 
-checkpoint_path = f'{local_data_path}/_checkpoints'
-schema_path = f'{local_data_path}/_schema'
+# checkpoint_path and schema_path of the stream are set in Utils/Medallion-Stages
 
-spark.sql("drop table if exists bronze_sales")
+# a missing landing zone or bronze table is set up from scratch in any mode - a checkpoint without its table would skip files already seen
+refresh_autoloader_datasets = provisioning_mode == 'full' \
+  or not _path_exists(autoloader_ingest_path) \
+  or not spark.catalog.tableExists("bronze_sales")
 
-refresh_autoloader_datasets = True
+# load the 2021 sales files with parallel backfill jobs instead of copying them to the landing zone
+backfill_history = True
+backfill_path = f"{dbfs_data_path}_backfill/"
 
 if refresh_autoloader_datasets:
   # Run these only if you want to start a fresh run!
+  spark.sql("drop table if exists bronze_sales")
   dbutils.fs.rm(checkpoint_path,True)
   dbutils.fs.rm(schema_path,True)
   dbutils.fs.rm(autoloader_ingest_path, True)
   
+  dbutils.fs.rm(backfill_path, True)
+  
   dbutils.fs.mkdirs(autoloader_ingest_path) #This would be a cloud storage location
   
-  dbutils.fs.cp(f"{dbfs_data_path}/sales_202110.json", autoloader_ingest_path)
-  dbutils.fs.cp(f"{dbfs_data_path}/sales_202111.json", autoloader_ingest_path)
-  dbutils.fs.cp(f"{dbfs_data_path}/sales_202112.json", autoloader_ingest_path)
+  if not backfill_history:
+    dbutils.fs.cp(f"{dataset_path}sales_202110.json", autoloader_ingest_path)
+    dbutils.fs.cp(f"{dataset_path}sales_202111.json", autoloader_ingest_path)
+    dbutils.fs.cp(f"{dataset_path}sales_202112.json", autoloader_ingest_path)
 
 
 
 # COMMAND ----------
 
-# MAGIC %sql
-# MAGIC DROP TABLE IF EXISTS bronze_sales;
-# MAGIC CREATE TABLE IF NOT EXISTS bronze_sales;
+# optimized writes, deletion vectors and the change feed are enabled on new and existing tables, see Utils/Medallion-Stages
+create_bronze_sales_table()
+
+# COMMAND ----------
+
+# history is loaded by one parallel job per month instead of the stream, see Utils/Backfill
+if refresh_autoloader_datasets and backfill_history:
+  run_backfill(backfill_partitions(dataset_path, ["202110", "202111", "202112"]), backfill_path)
 
 # COMMAND ----------
 
 # Set up the stream to begin reading incoming files from the autoloader_ingest_path location.
-df = spark.readStream.format('cloudFiles') \
-  .option('cloudFiles.format', 'json') \
-  .option("cloudFiles.schemaHints", "ts long, exported_ts long, SaleID string") \
-  .option('cloudFiles.schemaLocation', schema_path) \
-  .load(autoloader_ingest_path) \
-  .withColumn("file_path",F.input_file_name()) \
-  .withColumn("inserted_at", F.current_timestamp()) 
+# normalize timestamps sent as formatted strings and parse SaleItems while ingesting - see Utils/Bronze-Ingest
+df = read_sales_stream(autoloader_ingest_path, schema_path)
 
 streaming_autoloader = df.writeStream \
   .format('delta') \
@@ -308,6 +288,31 @@ spark.sql(f"USE DATABASE {database_name};")
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Small files compaction
+# MAGIC 
+# MAGIC Every store drop is a tiny JSON file and every Autoloader micro-batch appends its own small file to `bronze_sales`. Optimized writes (enabled on the table above) reduce the number of files written, and `compact_table` bin-packs the remaining small files into files of the table's `delta.targetFileSize` (set by the scheduled pipeline, see `Utils/Stage-Tuning`) or `compaction_target_file_size_mb` when it has none. It only runs `OPTIMIZE` when there are enough small files, so it is cheap to schedule periodically.
+
+# COMMAND ----------
+
+compact_table("bronze_sales")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC 
+# MAGIC Landing zone files that Autoloader has already processed (checked against the `cloud_files_state` of the stream checkpoint) can be rolled up into larger archives, so that directory listing stays fast. Set `roll_up_landing_zone` to run it - archives are written outside of `autoloader_ingest_path` so they are not ingested again.
+
+# COMMAND ----------
+
+roll_up_landing_zone = False
+
+if roll_up_landing_zone:
+  roll_up_landing_files(autoloader_ingest_path, f"{dbfs_data_path}/autoloader_archive/", checkpoint_path, min_age_days=7)
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC 
 # MAGIC ## Silver Layer
@@ -315,54 +320,24 @@ spark.sql(f"USE DATABASE {database_name};")
 # MAGIC Now that we have a bronze table ready - let's a create silver one! 
 # MAGIC 
 # MAGIC We can start by using same approach as for the dimension tables earlier - clean and de-duplicate data from bronze table, rename columns to be more business friendly and save it as silver table.
+# MAGIC 
+# MAGIC `ts` is stored as a `timestamp`, together with `sale_date` and `sales_month`. Both silver tables are partitioned by `sales_month`, so queries for a month only read that month's files and gold does not need to format `ts` for every row.
+# MAGIC 
+# MAGIC Sales, customers and sale items also get integer surrogate keys (`sale_key`, `customer_key`, `sale_item_key`) from `with_surrogate_keys`, so gold tables join and aggregate on compact integers.
+# MAGIC 
+# MAGIC A silver table written with an older layout (e.g. before the month partitions, typed timestamps or surrogate keys) cannot be merged into. `has_silver_layout` detects it, and the table is rebuilt from the view instead, also in `incremental` mode.
+# MAGIC 
+# MAGIC Silver tables are written through `apply_expectations` (see `Utils/Expectations`) - the same rules as in the DLT pipeline are checked in a single pass, per rule counts are printed and rows breaking a `quarantine` rule go to `silver_sales_quarantine` / `silver_sale_items_quarantine` instead of the silver table.
 
 # COMMAND ----------
 
-# MAGIC %sql 
-# MAGIC 
-# MAGIC create or replace view v_silver_sales 
-# MAGIC as 
-# MAGIC with with_latest_record_id as (
-# MAGIC   select
-# MAGIC     *,
-# MAGIC     row_number() over (
-# MAGIC       partition by SaleID
-# MAGIC       order by
-# MAGIC         coalesce(exported_ts, 0) desc
-# MAGIC     ) as latest_record
-# MAGIC   from
-# MAGIC     bronze_sales
-# MAGIC ),
-# MAGIC newest_records as (
-# MAGIC   select
-# MAGIC     saleID as id,
-# MAGIC     from_unixtime(ts) as ts,
-# MAGIC     Location as store_id,
-# MAGIC     CustomerID as customer_id,
-# MAGIC     location || "-" || cast(CustomerID as string) as unique_customer_id,
-# MAGIC     OrderSource as order_source,
-# MAGIC     STATE as order_state,
-# MAGIC     SaleItems as sale_items
-# MAGIC   from
-# MAGIC     with_latest_record_id
-# MAGIC   where
-# MAGIC     latest_record = 1
-# MAGIC )
-# MAGIC select
-# MAGIC   *,
-# MAGIC   sha2(concat_ws(*, '||'), 256) as row_hash -- add a hash of all values to easily pick up changed rows
-# MAGIC from
-# MAGIC   newest_records
+# v_silver_sales keeps the latest record of every sale, v_silver_sale_items has one row per sale item - see Utils/Medallion-Stages
+create_silver_views()
 
 # COMMAND ----------
 
-# MAGIC %sql 
-# MAGIC 
-# MAGIC drop table if exists silver_sales;
-# MAGIC 
-# MAGIC create table silver_sales 
-# MAGIC as
-# MAGIC select * from v_silver_sales;
+# rows breaking silver_sales_expectations are moved to silver_sales_quarantine, see Utils/Expectations
+provision("silver_sales", build_silver_sales, tables=["bronze_sales"])
 
 # COMMAND ----------
 
@@ -377,49 +352,8 @@ spark.sql(f"USE DATABASE {database_name};")
 
 # COMMAND ----------
 
-# MAGIC %sql 
-# MAGIC create or replace view v_silver_sale_items 
-# MAGIC as 
-# MAGIC with itemised_records as (
-# MAGIC   select
-# MAGIC     *,
-# MAGIC     posexplode(
-# MAGIC       from_json(
-# MAGIC         sale_items,
-# MAGIC         'array<struct<id:string,size:string,notes:string,cost:double,ingredients:array<string>>>'
-# MAGIC       )
-# MAGIC     )
-# MAGIC   from
-# MAGIC     v_silver_sales
-# MAGIC ),
-# MAGIC all_records as (
-# MAGIC   select
-# MAGIC     id || "-" || cast(pos as string) as id,
-# MAGIC     id as sale_id,
-# MAGIC     store_id,
-# MAGIC     pos as item_number,
-# MAGIC     col.id as product_id,
-# MAGIC     col.size as product_size,
-# MAGIC     col.notes as product_notes,
-# MAGIC     col.cost as product_cost,
-# MAGIC     col.ingredients as product_ingredients
-# MAGIC   from
-# MAGIC     itemised_records
-# MAGIC )
-# MAGIC select
-# MAGIC   *,
-# MAGIC   sha2(concat_ws(*, '||'), 256) as row_hash
-# MAGIC from
-# MAGIC   all_records
-
-# COMMAND ----------
-
-# MAGIC %sql 
-# MAGIC drop table if exists silver_sale_items;
-# MAGIC 
-# MAGIC create table silver_sale_items
-# MAGIC as
-# MAGIC select * from v_silver_sale_items;
+# Change Data Feed lets gold tables pick up only the changed items, so the table is kept up to date with MERGE after the first load
+provision("silver_sale_items", build_silver_sale_items, tables=["bronze_sales"])
 
 # COMMAND ----------
 
@@ -466,6 +400,23 @@ spark.sql(f"USE DATABASE {database_name};")
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Ingredient index
+# MAGIC 
+# MAGIC Z-ordering does not help with questions about `product_ingredients`, which is an array - every item row has to be exploded. `build_ingredient_index` keeps integer ingredient ids in `dim_ingredients`, a bridge table of item ingredient ids and per store and month ingredient bitmaps (see `Utils/Ingredients`), so ingredient queries only read the stores, months and files that contain the ingredient.
+
+# COMMAND ----------
+
+provision("silver_sale_item_ingredients", build_ingredient_index, tables=["silver_sale_items"])
+
+# COMMAND ----------
+
+# sale items containing kale in SYD01
+display(items_with_ingredient("Kale", store_id="SYD01"))
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC 
 # MAGIC ### SCHEMA EVOLUTION
@@ -491,6 +442,8 @@ spark.sql(f"USE DATABASE {database_name};")
 # MAGIC %md
 # MAGIC 
 # MAGIC `_rescued_data` column contains any parsing errors. There should be none if everything remains as an autoloader default string, but we have provided SchemaHints value before.
+# MAGIC 
+# MAGIC The fixed records were sent with `ts` as a formatted string, so the original value is kept in `_rescued_data`. Our stream already parsed it with `ts_parsers`, so `ts` is populated and there is no need to update `bronze_sales` afterwards.
 
 # COMMAND ----------
 
@@ -502,42 +455,31 @@ spark.sql(f"USE DATABASE {database_name};")
 
 # MAGIC %sql
 # MAGIC 
-# MAGIC select * from bronze_sales
+# MAGIC select ts, _rescued_data:ts as rescued_ts, * from bronze_sales
 # MAGIC where location = 'SYD01'
 # MAGIC and saleid = 'd2e70607-02f7-417d-a5cb-be301c66bb03'
 
 # COMMAND ----------
 
-# MAGIC %sql
-# MAGIC 
-# MAGIC -- use rescued data to update ts column values
-# MAGIC 
-# MAGIC update bronze_sales
-# MAGIC set ts = unix_timestamp(_rescued_data:ts)
-# MAGIC where _rescued_data is not null 
-# MAGIC and ts is null
+# update Silver table with change values and keep single row for each sale transaction by using MERGE
+update_silver_sales()
 
 # COMMAND ----------
 
-# MAGIC %sql
-# MAGIC 
-# MAGIC select * from bronze_sales
-# MAGIC where location = 'SYD01'
-# MAGIC and saleid = 'd2e70607-02f7-417d-a5cb-be301c66bb03'
+# silver_sales is now in sync with bronze_sales - record it so the next incremental run does not rebuild it
+record_provisioning("silver_sales", input_fingerprint(tables=["bronze_sales"]))
 
 # COMMAND ----------
 
-# MAGIC %sql
-# MAGIC 
-# MAGIC -- update Silver table with change values and keep single row for each sale transaction by using MERGE
+# MAGIC %md
 # MAGIC 
-# MAGIC merge into silver_sales target
-# MAGIC    using v_silver_sales source
-# MAGIC    on target.id = source.id
-# MAGIC when matched and target.row_hash <> source.row_hash then 
-# MAGIC   update set *
-# MAGIC when not matched then
-# MAGIC   insert *
+# MAGIC Downstream consumers do not need to re-read the whole table to find what the MERGE changed - `changes` (see `Utils/Table-Changes`) returns only the changed rows between two table versions.
+
+# COMMAND ----------
+
+silver_sales_version = table_version("silver_sales")
+
+display(changes("silver_sales", silver_sales_version - 1, silver_sales_version))
 
 # COMMAND ----------
 
@@ -555,17 +497,8 @@ spark.sql(f"USE DATABASE {database_name};")
 
 # COMMAND ----------
 
-# MAGIC %sql
-# MAGIC 
-# MAGIC drop table if exists gold_country_sales;
-# MAGIC 
-# MAGIC create table gold_country_sales 
-# MAGIC as 
-# MAGIC select l.country_code, date_format(sales.ts, 'yyyy-MM') as sales_month, sum(product_cost) as total_sales, count(distinct sale_id) as number_of_sales
-# MAGIC from silver_sale_items s 
-# MAGIC   join dim_locations l on s.store_id = l.id
-# MAGIC   join silver_sales sales on s.sale_id = sales.id
-# MAGIC group by l.country_code, date_format(sales.ts, 'yyyy-MM');
+# small enough to be aggregated on the driver (see Utils/Local-Engine), the plan is recorded for the Spark path (see Utils/Query-Profiles)
+provision("gold_country_sales", build_gold_country_sales, tables=["silver_sale_items", "dim_locations"])
 
 # COMMAND ----------
 
@@ -574,32 +507,105 @@ spark.sql(f"USE DATABASE {database_name};")
 
 # COMMAND ----------
 
-# MAGIC %sql
-# MAGIC 
-# MAGIC drop table if exists gold_top_customers;
+# MAGIC %md
 # MAGIC 
-# MAGIC create table gold_top_customers 
-# MAGIC as
-# MAGIC select s.store_id, ss.unique_customer_id, c.name, sum(product_cost) total_spend 
-# MAGIC from silver_sale_items s 
-# MAGIC   join silver_sales ss on s.sale_id = ss.id
-# MAGIC   join dim_customers c on ss.unique_customer_id = c.unique_id
-# MAGIC where ss.unique_customer_id is not null 
-# MAGIC group by s.store_id, ss.unique_customer_id, c.name;
+# MAGIC `gold_top_customers` and the per store leaderboard `gold_store_leaderboard` are maintained incrementally from the spend changes of new sale items (see `Utils/Top-Customers`). Only the first run aggregates all sales.
+
+# COMMAND ----------
+
+update_top_customers(k=3)
 
 # COMMAND ----------
 
 # MAGIC %sql
 # MAGIC -- get top 3 customers for each store
-# MAGIC with ranked_customers as (
-# MAGIC select store_id, name as customer_name, total_spend as customer_spend, rank() over (partition by store_id order by total_spend desc) as customer_rank 
-# MAGIC from gold_top_customers )
-# MAGIC select * from ranked_customers
+# MAGIC select store_id, customer_name, customer_spend, customer_rank
+# MAGIC from gold_store_leaderboard
 # MAGIC where customer_rank <= 3
 # MAGIC order by store_id, customer_rank
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Exporting gold tables
+# MAGIC 
+# MAGIC Analysts often want gold tables as pandas DataFrames. `to_pandas` uses Arrow based conversion, and `export_arrow_file` writes a table as an Arrow IPC file that local consumers can open memory-mapped with `read_arrow_file` (see `Utils/Arrow-Export`).
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Arrow-Export
+
+# COMMAND ----------
+
+country_sales_pdf = to_pandas("gold_country_sales")
+
+gold_export_path = f"{local_data_path}exports/"
+for table_name in ["gold_country_sales", "gold_top_customers"]:
+  export_arrow_file(table_name, f"{gold_export_path}{table_name}.arrow")
+
+top_customers_pdf = read_arrow_file(f"{gold_export_path}gold_top_customers.arrow").to_pandas()
+top_customers_pdf.head()
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Dimension lookups
+# MAGIC 
+# MAGIC The serving layer resolves customer and store ids many times per request. `refresh_lookup_snapshots` exports `dim_customers` and `dim_locations` as key sorted Arrow files whenever their Delta version changes, and `customer_details` / `store_country` look keys up in the memory-mapped files on the driver's local disk without touching the cluster (see `Utils/Dimension-Lookup`).
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Dimension-Lookup
+
+# COMMAND ----------
+
+refresh_lookup_snapshots()
+
+sample_customer = spark.table("dim_customers").select("unique_id", "store_id").first()
+print(customer_details(sample_customer.unique_id), store_country(sample_customer.store_id))
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Log retention
+# MAGIC 
+# MAGIC Every Autoloader micro-batch, MERGE and OPTIMIZE adds a commit to `_delta_log`, and opening a table replays all commits since the last checkpoint. `apply_retention_policy` applies the checkpoint interval and log / deleted file retention of the table's layer (`retention_policies` in `Utils/Table-Maintenance`), vacuums old files and reports how long opening the table from scratch takes before and after to `table_retention_reports` in the aux database - replaying the log on the driver for tables on DBFS, a `DESCRIBE DETAIL` with Delta's snapshot cache cleared otherwise (`cold_open` is false where the cache cannot be cleared). A new checkpoint interval only shows from the next checkpoint on, so compare the reports across runs as well.
+# MAGIC 
+# MAGIC Corrections and MERGEs on bronze and silver tables only write deletion vectors and the changed rows. The `5 Table Maintenance` job rewrites the affected files with `purge_deletion_vectors` once more than `deletion_vector_purge_ratio` of the rows are deleted, the old files are then removed by `VACUUM`.
+
+# COMMAND ----------
+
+for table_name in ["bronze_sales", "silver_sales", "silver_sale_items", "gold_country_sales"]:
+  apply_retention_policy(table_name)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Storage profiles
+# MAGIC 
+# MAGIC Bronze, silver and gold tables are read very differently, so each layer gets its own Parquet codec, row group size and data skipping statistics (`storage_profiles` in `Utils/Storage-Profiles`). Row group size and statistics columns are kept in the table properties, so every later write to the table uses them. Spark ignores a codec in the table properties, so the codec is only applied while the stages of the `6 Daily Pipeline` job write (see `Utils/Stage-Tuning`) - writes in this notebook use the session default. Existing files keep their old codec and statistics until they are rewritten. `benchmark_storage_profiles` writes a copy of a table with each profile the way the pipeline stages do and compares size, write time and scan time - it copies the table three times, so it only runs with `run_storage_benchmark` set.
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Storage-Profiles
+
+# COMMAND ----------
+
+for table_name in ["bronze_sales", "silver_sales", "silver_sale_items", "gold_country_sales", "gold_top_customers"]:
+  apply_storage_profile(table_name)
+
+# copies silver_sale_items once per profile - only needed when the profiles change
+run_storage_benchmark = False
+if run_storage_benchmark:
+  benchmark_storage_profiles("silver_sale_items", filter_expr="store_id = 'MEL01' and sale_date = '2021-11-15'")
+  display(spark.table(storage_benchmark_table).orderBy(F.desc("benchmarked_at")))
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC 
 # MAGIC Stop streaming autoloader to allow our cluster to shut down.
@@ -618,4 +624,4 @@ streaming_autoloader.stop()
 
 # MAGIC %md
 # MAGIC 
-# MAGIC We can schedule this Notebook to run every day.
+# MAGIC Daily updates are not scheduled from this notebook - it streams, injects demo records and rewrites tables along the way. Schedule the `6 Daily Pipeline` notebook instead: it runs the same stages (defined in `Utils/Medallion-Stages`) with `run_pipeline` (see `Utils/Pipeline-Runner`) as a dependency graph - dimensions, bronze ingest and both silver tables run concurrently where their inputs allow, stages with unchanged inputs are skipped and `resume=True` continues a failed run from the failed stage.
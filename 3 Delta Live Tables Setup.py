@@ -27,10 +27,15 @@
 
 # COMMAND ----------
 
-setup_responses = dbutils.notebook.run("./Utils/Setup-Datasets", 0).split()
+# MAGIC %run ./Utils/Bootstrap
 
-local_data_path = setup_responses[0]
-dbfs_data_path = setup_responses[1]
+# COMMAND ----------
+
+session = bootstrap("Disabled", setup_notebook="./Utils/Setup-Datasets")
+
+local_data_path = session["local_data_path"]
+dbfs_data_path = session["dbfs_data_path"]
+dataset_path = session["dataset_path"]
 
 dlt_ingest_path = f"{dbfs_data_path}/dlt_ingest/"
 
@@ -40,6 +45,14 @@ dlt_ingest_path = f"{dbfs_data_path}/dlt_ingest/"
 
 # COMMAND ----------
 
+# MAGIC %run ./Utils/Dimension-Loader
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Dataset-Cache
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ## Prepare files for DLT
 # MAGIC 
@@ -54,7 +67,13 @@ if refresh_dlt_datasets:
   
   dbutils.fs.mkdirs(dlt_ingest_path)
   
-  dbutils.fs.cp(f"{dbfs_data_path}/sales_202112.json", dlt_ingest_path)
+  dbutils.fs.cp(f"{dataset_path}sales_202112.json", dlt_ingest_path)
+
+# the pipeline reads dimension files from the user folder, copy them from the shared dataset cache
+copy_user_datasets(dataset_path, dbfs_data_path, ["users.json", "stores.json", "products.json"])
+
+# store to country lookup used by dim_locations_dlt
+write_store_countries_file(f"{dbfs_data_path}store_countries.json")
 
 # COMMAND ----------
 
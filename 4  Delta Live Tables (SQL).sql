@@ -29,9 +29,11 @@ CREATE INCREMENTAL LIVE TABLE bronze_sales_dlt
 TBLPROPERTIES ("quality" = "bronze")
 COMMENT "Bronze sales table with all transactions"
 AS 
-SELECT * 
+-- parse SaleItems once while ingesting, downstream tables read the typed column
+SELECT * EXCEPT (SaleItems),
+  from_json(SaleItems, 'array<struct<id:string,size:string,notes:string,cost:double,ingredients:array<string>>>') as SaleItems
 FROM
-cloud_files( '/FileStore/${mypipeline.data_path}/deltademoasset/dlt_ingest/' , "json") 
+cloud_files( '/FileStore/${mypipeline.data_path}/deltademoasset/dlt_ingest/' , "json", map("cloudFiles.schemaHints", "SaleItems string")) 
 
 -- COMMAND ----------
 
@@ -45,15 +47,26 @@ FROM
 json.`/FileStore/${mypipeline.data_path}/deltademoasset/users.json`;
 
 
+-- COMMAND ----------
+
+CREATE TEMPORARY LIVE TABLE store_countries_dlt
+TBLPROPERTIES ("quality" = "lookup")
+COMMENT "Store to country lookup - not included in database"
+AS 
+SELECT id, country_code
+FROM  
+json.`/FileStore/${mypipeline.data_path}/deltademoasset/store_countries.json`;
+
 -- COMMAND ----------
 
 CREATE TEMPORARY LIVE TABLE dim_locations_dlt
 TBLPROPERTIES ("quality" = "lookup")
 COMMENT "Store locations dimension - not included in database"
 AS 
-SELECT *, case when id in ('SYD01', 'MEL01', 'BNE02', 'MEL02', 'PER01', 'CBR01') then 'AUS' when id in ('AKL01', 'AKL02', 'WLG01') then 'NZL' end as country_code 
+SELECT /*+ BROADCAST(c) */ l.*, c.country_code 
 FROM  
-json.`/FileStore/${mypipeline.data_path}/deltademoasset/stores.json`;
+json.`/FileStore/${mypipeline.data_path}/deltademoasset/stores.json` l
+  LEFT JOIN live.store_countries_dlt c ON l.id = c.id;
 
 -- COMMAND ----------
 
@@ -103,11 +116,14 @@ CREATE INCREMENTAL LIVE TABLE silver_sales_dlt (
   CONSTRAINT `Location has to be 5 characters long` EXPECT (length(store_id) = 5),
   CONSTRAINT `Only CANCELED and COMPLETED transactions are allowed` EXPECT (order_state IN ('CANCELED', 'COMPLETED'))
 ) 
+PARTITIONED BY (sales_month)
 TBLPROPERTIES ("quality" = "silver")
 COMMENT "Silver table with clean transaction records" AS
   SELECT
     saleID as id,
-    from_unixtime(ts) as ts,
+    timestamp_seconds(ts) as ts,
+    to_date(timestamp_seconds(ts)) as sale_date,
+    date_format(timestamp_seconds(ts), 'yyyy-MM') as sales_month,
     Location as store_id,
     CustomerID as customer_id,
     location || "-" || cast(CustomerID as string) as unique_customer_id,
@@ -121,6 +137,7 @@ COMMENT "Silver table with clean transaction records" AS
 CREATE INCREMENTAL LIVE TABLE silver_sale_items_dlt (
   CONSTRAINT `All custom juice must have ingredients` EXPECT (NOT(product_id = 'Custom' and size(product_ingredients) = 0))
 ) 
+PARTITIONED BY (sales_month)
 TBLPROPERTIES ("quality" = "silver")
 COMMENT "Silver table with clean transaction records" AS
 
@@ -128,6 +145,8 @@ SELECT
     id || "-" || cast(pos as string) as id,
     id as sale_id,
     store_id,
+    sale_date,
+    sales_month,
     pos as item_number,
     col.id as product_id,
     col.size as product_size,
@@ -138,17 +157,14 @@ SELECT
     (
   select
     *,
-    posexplode(
-      from_json(
-        sale_items,
-        'array<struct<id:string,size:string,notes:string,cost:double,ingredients:array<string>>>'
-      )
-    ) 
+    posexplode(sale_items) 
   from
     (
       SELECT
     saleID as id,
-    from_unixtime(ts) as ts,
+    timestamp_seconds(ts) as ts,
+    to_date(timestamp_seconds(ts)) as sale_date,
+    date_format(timestamp_seconds(ts), 'yyyy-MM') as sales_month,
     Location as store_id,
     CustomerID as customer_id,
     location || "-" || cast(CustomerID as string) as unique_customer_id,
@@ -183,11 +199,10 @@ group by l.country_code;
 -- COMMAND ----------
 
 CREATE LIVE TABLE country_monthly_sales_dlt
-select l.country_code, date_format(sales.ts, 'yyyy-MM') as sales_month, sum(product_cost) as total_sales, count(distinct sale_id) as number_of_sales
+select l.country_code, s.sales_month, sum(product_cost) as total_sales, count(distinct sale_id) as number_of_sales
 from live.silver_sale_items_dlt s 
   join live.dim_locations_dlt l on s.store_id = l.id
-  join live.silver_sales_dlt sales on s.sale_id = sales.id
-group by l.country_code, date_format(sales.ts, 'yyyy-MM');
+group by l.country_code, s.sales_month;
 
 -- COMMAND ----------
 
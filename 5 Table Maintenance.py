@@ -0,0 +1,65 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC # APJuice Table Maintenance
+# MAGIC 
+# MAGIC Periodic maintenance of the tables built by `1 Data ingestion` and `2 Medaillon architecture`. Schedule this notebook as its own job (e.g. nightly), separate from the ingest pipeline, so file rewrites never slow down or conflict with the daily updates:
+# MAGIC * `purge_deletion_vectors` rewrites files once more than `deletion_vector_purge_ratio` of their rows are deleted - tables on cloud storage (e.g. with Unity Catalog) are always purged, as their log cannot be read on the driver
+# MAGIC * `apply_retention_policy` applies the checkpoint interval and log / file retention of each layer and vacuums the files removed by the purge
+# MAGIC 
+# MAGIC See `Utils/Table-Maintenance` for the policies.
+
+# COMMAND ----------
+
+dbutils.widgets.dropdown("uc_status", "Enabled", ["Enabled", "Disabled"], "Unity Catalog")
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Bootstrap
+
+# COMMAND ----------
+
+uc_status = dbutils.widgets.get("uc_status")
+print("Unity Catalog : {}".format(uc_status))
+
+# maintenance never drops tables - reuse the session of the ingest notebooks
+session = bootstrap(uc_status, "incremental")
+
+local_data_path = session["local_data_path"]
+dbfs_data_path = session["dbfs_data_path"]
+database_name = session["database_name"]
+
+if uc_status == 'Enabled':
+  catalog_name = session["catalog_name"]
+  print("Catalog name is {}".format(catalog_name))
+  spark.sql(f"USE CATALOG {catalog_name};")
+print("Database name is {}".format(database_name))
+spark.sql(f"USE DATABASE {database_name};")
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Table-Maintenance
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Deletion vectors
+
+# COMMAND ----------
+
+for table_name in ["stores", "bronze_sales", "silver_sales", "silver_sale_items"]:
+  if spark.catalog.tableExists(table_name):
+    purge_deletion_vectors(table_name)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Log retention
+
+# COMMAND ----------
+
+for table_name in ["bronze_sales", "silver_sales", "silver_sale_items", "gold_country_sales"]:
+  if spark.catalog.tableExists(table_name):
+    apply_retention_policy(table_name)
@@ -0,0 +1,101 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC # APJuice Daily Pipeline
+# MAGIC 
+# MAGIC Daily update of the tables built by `2 Medaillon architecture`. Schedule this notebook as a job instead of the walkthrough, which streams, injects demo records and rewrites tables along the way.
+# MAGIC 
+# MAGIC `run_pipeline` (see `Utils/Pipeline-Runner`) runs the stages of `Utils/Medallion-Stages` as a dependency graph - dimensions, bronze ingest and both silver tables run concurrently where their inputs allow, stages with unchanged inputs are skipped and `resume=True` continues a failed run from the failed stage. Bronze ingest keeps track of processed files in its stream checkpoint and dimensions are provisioned by `load_dimension`, so these stages are not gated by the runner.
+# MAGIC 
+# MAGIC The job never drops tables - run `2 Medaillon architecture` once with `provisioning_mode` set to `full` to set them up.
+
+# COMMAND ----------
+
+dbutils.widgets.dropdown("uc_status", "Enabled", ["Enabled", "Disabled"], "Unity Catalog")
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Bootstrap
+
+# COMMAND ----------
+
+uc_status = dbutils.widgets.get("uc_status")
+print("Unity Catalog : {}".format(uc_status))
+
+# the daily run only rebuilds what changed - reuse the session of the ingest notebooks
+session = bootstrap(uc_status, "incremental")
+
+local_data_path = session["local_data_path"]
+dbfs_data_path = session["dbfs_data_path"]
+dataset_path = session["dataset_path"]
+database_name = session["database_name"]
+
+autoloader_ingest_path = f"{dbfs_data_path}/autoloader_ingest/"
+
+if uc_status == 'Enabled':
+  catalog_name = session["catalog_name"]
+  print("Catalog name is {}".format(catalog_name))
+  spark.sql(f"USE CATALOG {catalog_name};")
+print("Database name is {}".format(database_name))
+spark.sql(f"USE DATABASE {database_name};")
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Define-Functions $uc_status=$uc_status
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Provisioning $provisioning_mode=incremental
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Table-Maintenance
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Bronze-Ingest
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Dimension-Loader
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Top-Customers
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Ingredients
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Expectations
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Surrogate-Keys
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Dimension-Lookup
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Pipeline-Runner
+
+# COMMAND ----------
+
+# MAGIC %run ./Utils/Medallion-Stages
+
+# COMMAND ----------
+
+# a first run in a new workspace starts with an empty landing zone, the objects below are no-ops when they exist
+dbutils.fs.mkdirs(autoloader_ingest_path)
+create_bronze_sales_table()
+create_silver_views()
+# the store mapping lives in code, so it is checked on every run
+create_store_countries_table("store_countries")
+
+# COMMAND ----------
+
+run_pipeline(daily_stages())
@@ -0,0 +1,92 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Arrow Export
+# MAGIC 
+# MAGIC Moves tables from Spark to Python consumers as Arrow record batches instead of rows:
+# MAGIC * `to_pandas` - `toPandas()` with Arrow based conversion enabled
+# MAGIC * `arrow_batches` - Arrow record batches of a DataFrame, built on the executors with `mapInArrow` and fetched one partition at a time with `toLocalIterator`, so rows never become Python objects and only one partition is held on the driver
+# MAGIC * `arrow_conf` - turns on Arrow based conversion for a block and restores the session settings afterwards
+# MAGIC * `export_arrow_file` / `read_arrow_file` - write a table as an Arrow IPC (Feather v2) file and open it memory-mapped, so local consumers can load it without a cluster
+# MAGIC 
+# MAGIC `arrow_batch_size` controls the number of records per Arrow batch.
+
+# COMMAND ----------
+
+import os
+from contextlib import contextmanager
+
+arrow_batch_size = 10000
+
+
+@contextmanager
+def arrow_conf(batch_size=arrow_batch_size, self_destruct=False):
+    # session settings only for the conversion, so other code in the session keeps its own
+    confs = {
+        "spark.sql.execution.arrow.pyspark.enabled": "true",
+        "spark.sql.execution.arrow.maxRecordsPerBatch": str(batch_size),
+        # free Arrow buffers while building the pandas DataFrame instead of holding both copies
+        "spark.sql.execution.arrow.pyspark.selfDestruct.enabled": str(self_destruct).lower(),
+    }
+    previous = {conf: spark.conf.get(conf, None) for conf in confs}
+    for conf, value in confs.items():
+        spark.conf.set(conf, value)
+    try:
+        yield
+    finally:
+        for conf, value in previous.items():
+            if value is None:
+                spark.conf.unset(conf)
+            else:
+                spark.conf.set(conf, value)
+
+
+def to_pandas(table_name, batch_size=arrow_batch_size):
+    with arrow_conf(batch_size, self_destruct=True):
+        return spark.table(table_name).toPandas()
+
+
+def _ipc_batches(batches):
+    import pyarrow as pa
+
+    # runs on the executors - every record batch travels to the driver as one serialized Arrow stream
+    for batch in batches:
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+        yield pa.RecordBatch.from_pydict({"batch": [sink.getvalue().to_pybytes()]})
+
+
+def arrow_batches(df, batch_size=arrow_batch_size):
+    import pyarrow as pa
+    from pyspark.sql.pandas.types import to_arrow_schema
+
+    schema = to_arrow_schema(df.schema)
+    # executors build the batches (mapInArrow) and the driver fetches one partition at a time, so rows are never Python objects
+    # and tables larger than driver memory can be exported
+    with arrow_conf(batch_size):
+        for row in df.mapInArrow(_ipc_batches, "batch binary").toLocalIterator(prefetchPartitions=True):
+            for batch in pa.ipc.open_stream(row.batch):
+                # timestamps arrive in the session time zone
+                yield from pa.Table.from_batches([batch]).cast(schema).to_batches()
+
+# COMMAND ----------
+
+def export_arrow_file(table_name, path, batch_size=arrow_batch_size):
+    import pyarrow as pa
+    from pyspark.sql.pandas.types import to_arrow_schema
+
+    df = spark.table(table_name)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # uncompressed, so the file can be memory-mapped without copying
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, to_arrow_schema(df.schema)) as writer:
+        for batch in arrow_batches(df, batch_size):
+            writer.write_batch(batch)
+    return path
+
+
+def read_arrow_file(path):
+    import pyarrow as pa
+
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
@@ -0,0 +1,93 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Backfill
+# MAGIC 
+# MAGIC Loads historical sales files into `bronze_sales` in parallel instead of copying them into the landing zone one by one for a single stream:
+# MAGIC * `backfill_partitions` splits history into one partition per month file, optionally further split per store
+# MAGIC * every partition is an Autoloader `availableNow` job with its own checkpoint, writing to its own staging table - jobs run concurrently and never commit to the same table
+# MAGIC * `merge_backfill` merges all staging tables into `bronze_sales` with a single insert-only MERGE (`WITH SCHEMA EVOLUTION` for new fields), and the staging tables are dropped afterwards
+# MAGIC 
+# MAGIC Re-running a backfill is idempotent: checkpoints skip files already processed and the MERGE skips rows already in bronze. Silver tables pick the new rows up on their next update.
+
+# COMMAND ----------
+
+# MAGIC %run ./Bronze-Ingest
+
+# COMMAND ----------
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import reduce
+
+import pyspark.sql.functions as F
+
+
+def backfill_partitions(source_path, months, store_ids=None):
+    partitions = []
+    for month in months:
+        for store_id in store_ids or [None]:
+            partitions.append({
+                "name": month if store_id is None else f"{month}_{store_id}",
+                "source_path": source_path,
+                "file_pattern": f"sales_{month}.json",
+                "store_id": store_id,
+            })
+    return partitions
+
+
+def backfill_staging_table(partition):
+    return f"bronze_sales_backfill_{partition['name'].lower()}"
+
+# COMMAND ----------
+
+def run_backfill_partition(partition, work_path):
+    partition_path = f"{work_path}{partition['name']}/"
+
+    df = read_sales_stream(partition["source_path"], f"{partition_path}_schema", partition["file_pattern"])
+    if partition["store_id"] is not None:
+        df = df.where(F.col("Location") == partition["store_id"])
+
+    df.writeStream \
+      .format("delta") \
+      .option("checkpointLocation", f"{partition_path}_checkpoint") \
+      .option("mergeSchema", "true") \
+      .trigger(availableNow=True) \
+      .toTable(backfill_staging_table(partition)) \
+      .awaitTermination()
+    return backfill_staging_table(partition)
+
+
+def merge_backfill(staging_tables, target_table="bronze_sales"):
+    staged = reduce(lambda a, b: a.unionByName(b, allowMissingColumns=True), [spark.table(t) for t in staging_tables])
+    staged.createOrReplaceTempView("bronze_sales_backfill")
+
+    if not spark.table(target_table).columns:
+        # bronze_sales gets its schema from the first write
+        staged.write.mode("append").option("mergeSchema", "true").saveAsTable(target_table)
+        return spark.table(target_table).count()
+
+    # schema evolution lets the MERGE add columns when a month has new fields, without changing the session conf
+    return spark.sql(f"""
+    merge with schema evolution into {target_table} target
+      using bronze_sales_backfill source
+      on target.SaleID = source.SaleID
+        and target.Location <=> source.Location
+        and target.exported_ts <=> source.exported_ts
+        and target.file_path <=> source.file_path
+    when not matched then
+      insert *
+    """).first()["num_inserted_rows"]
+
+
+def run_backfill(partitions, work_path, max_workers=4, target_table="bronze_sales"):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_backfill_partition, partition, work_path): partition["name"] for partition in partitions}
+        staging_tables = [future.result() for future in as_completed(futures)]
+
+    inserted_rows = merge_backfill(staging_tables, target_table)
+
+    # staging tables are only dropped once merged - the checkpoints stay, so a re-run only stages new files
+    for staging_table in staging_tables:
+        spark.sql(f"drop table if exists {staging_table}")
+    print(f"{target_table}: backfilled {inserted_rows} rows from {len(partitions)} partitions")
+    return inserted_rows
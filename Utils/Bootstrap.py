@@ -0,0 +1,83 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Session Bootstrap
+# MAGIC 
+# MAGIC Resolves user, catalog, database and data paths once and memoizes them per user and `uc_status`:
+# MAGIC * in-process, so `%run ./Utils/Define-Functions` and other helper notebooks reuse what the calling notebook already resolved
+# MAGIC * in a small json file on the driver, so other notebooks attached to the same (warm) cluster skip the setup notebook entirely
+# MAGIC 
+# MAGIC Sessions are keyed by user, `uc_status` and setup notebook, as `Setup-Batch` and `Setup-Datasets` provision different environments. Helper notebooks calling `bootstrap` without a setup notebook get the session of the notebook that bootstrapped before them.
+# MAGIC 
+# MAGIC `bootstrap` only runs the setup notebook when nothing is cached, the cached session does not point to the user's catalog and database or they are gone, or `provisioning_mode` is `full`.
+
+# COMMAND ----------
+
+# MAGIC %run ./Fetch-User-Metadata
+
+# COMMAND ----------
+
+import json
+import os
+
+bootstrap_cache_dir = "/tmp/apjuice_bootstrap"
+
+default_setup_notebook = "./Utils/Setup-Batch"
+
+# keep the memoized sessions when this notebook is %run again from a helper notebook
+_bootstrap_cache = globals().get("_bootstrap_cache", {})
+# setup notebook last bootstrapped per uc_status in this process
+_bootstrap_setup_notebooks = globals().get("_bootstrap_setup_notebooks", {})
+
+
+def _bootstrap_cache_file(key):
+    return f"{bootstrap_cache_dir}/{''.join(c if c.isalnum() else '_' for c in key)}.json"
+
+
+def _is_valid_session(session, user_metadata, uc_status):
+    if not os.path.exists(session["local_data_path"]):
+        return False
+    # the session has to point to this user's catalog and database, and they have to still exist
+    expected_catalog = user_metadata["catalog_name"] if uc_status == "Enabled" else None
+    if session["database_name"] != user_metadata["database_name"] or session["catalog_name"] != expected_catalog:
+        return False
+    database = session["database_name"] if session["catalog_name"] is None else f"{session['catalog_name']}.{session['database_name']}"
+    return spark.catalog.databaseExists(database)
+
+
+def _load_cached_session(key, user_metadata, uc_status):
+    session = _bootstrap_cache.get(key)
+    if session is None:
+        cache_file = _bootstrap_cache_file(key)
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                session = json.load(f)
+    if session is not None and _is_valid_session(session, user_metadata, uc_status):
+        return session
+    return None
+
+
+def bootstrap(uc_status, provisioning_mode=None, setup_notebook=None):
+    # provisioning_mode=None reuses any cached session and only falls back to an incremental setup
+    # setup_notebook=None reuses the setup of the calling notebook (e.g. from Define-Functions), Setup-Batch otherwise
+    user_metadata = resolve_user_metadata()
+    setup_notebook = setup_notebook or _bootstrap_setup_notebooks.get(uc_status, default_setup_notebook)
+    # setup notebooks provision different datasets, so each gets its own session
+    key = f"{user_metadata['username']}_{uc_status}_{setup_notebook.split('/')[-1]}"
+
+    session = None if provisioning_mode == "full" else _load_cached_session(key, user_metadata, uc_status)
+    if session is None:
+        session = json.loads(dbutils.notebook.run(setup_notebook, 0, {
+            "uc_status": uc_status,
+            "provisioning_mode": provisioning_mode or "incremental",
+        }))
+        if uc_status != "Enabled":
+            session["catalog_name"] = None
+
+        os.makedirs(bootstrap_cache_dir, exist_ok=True)
+        with open(_bootstrap_cache_file(key), "w") as f:
+            json.dump(session, f)
+
+    _bootstrap_cache[key] = session
+    _bootstrap_setup_notebooks[uc_status] = setup_notebook
+    return session
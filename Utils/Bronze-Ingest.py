@@ -0,0 +1,73 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Bronze Ingest
+# MAGIC 
+# MAGIC Transformations applied to sales records while they are ingested into `bronze_sales`, so rows land typed and bronze does not need corrective updates afterwards.
+# MAGIC 
+# MAGIC Stores do not always send `ts` as epoch seconds - some exports send it as a formatted string (e.g. `from_unixtime(ts)`). With the `ts long` schema hint those values end up in `_rescued_data`. `normalize_ts` tries each parser in `ts_parsers` in order against the rescued value and keeps the first one that parses - parsers return null for values they cannot parse, also with ANSI mode on.
+# MAGIC 
+# MAGIC `SaleItems` arrives as a JSON string. `parse_sale_items` parses it once into a typed `sale_items_schema` column, so silver and gold queries read the nested fields directly instead of re-running `from_json`. Set `keep_raw_sale_items` to also keep the original string in `SaleItemsRaw`.
+# MAGIC 
+# MAGIC `read_sales_stream` is the Autoloader source of `bronze_sales` with all of the above applied, shared by the ingest stream and the backfill jobs (see `Utils/Backfill`).
+
+# COMMAND ----------
+
+import pyspark.sql.functions as F
+
+
+def parse_epoch(value):
+    return F.when(value.rlike("^[0-9]+$"), value.cast("long"))
+
+
+def parse_format(pattern):
+    # null instead of an error for values in another format (ANSI mode), so the next parser gets its turn
+    return lambda value: F.try_to_timestamp(value, F.lit(pattern)).cast("long")
+
+
+ts_parsers = [
+    parse_epoch,
+    parse_format("yyyy-MM-dd HH:mm:ss"),
+    parse_format("yyyy-MM-dd'T'HH:mm:ss"),
+]
+
+# COMMAND ----------
+
+sale_items_schema = "array<struct<id:string,size:string,notes:string,cost:double,ingredients:array<string>>>"
+keep_raw_sale_items = False
+
+
+def normalize_ts(df, column="ts", parsers=None):
+    parsers = ts_parsers if parsers is None else parsers
+
+    rescued_value = F.get_json_object(F.col("_rescued_data"), f"$.{column}")
+    return df.withColumn(column, F.coalesce(F.col(column), *[parse(rescued_value) for parse in parsers]))
+
+
+def parse_sale_items(df, keep_raw=None):
+    keep_raw = keep_raw_sale_items if keep_raw is None else keep_raw
+
+    if keep_raw:
+        df = df.withColumn("SaleItemsRaw", F.col("SaleItems"))
+    return df.withColumn("SaleItems", F.from_json(F.col("SaleItems"), sale_items_schema))
+
+
+def prepare_bronze_sales(df, parsers=None, keep_raw=None):
+    return parse_sale_items(normalize_ts(df, "ts", parsers), keep_raw)
+
+# COMMAND ----------
+
+bronze_sales_schema_hints = "ts long, exported_ts long, SaleID string, SaleItems string"
+
+
+def read_sales_stream(source_path, schema_path, path_glob_filter=None):
+    reader = spark.readStream.format("cloudFiles") \
+      .option("cloudFiles.format", "json") \
+      .option("cloudFiles.schemaHints", bronze_sales_schema_hints) \
+      .option("cloudFiles.schemaLocation", schema_path)
+    if path_glob_filter is not None:
+        reader = reader.option("pathGlobFilter", path_glob_filter)
+
+    return prepare_bronze_sales(reader.load(source_path)) \
+      .withColumn("file_path", F.input_file_name()) \
+      .withColumn("inserted_at", F.current_timestamp())
@@ -0,0 +1,101 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Dataset Cache
+# MAGIC 
+# MAGIC Raw workshop datasets are the same for every user, so they are extracted once into a shared, content-addressed directory instead of into every user's `deltademoasset` folder:
+# MAGIC * `shared_dataset_root/<digest>/` holds the extracted files, where the digest is a sha256 of the archive contents - changed archives get a new directory, unchanged ones are never extracted again. Digests are kept on the driver by archive size and modification time, so archives are only hashed again when they changed
+# MAGIC * every setup extracts into its own subdirectory and then publishes it in a `_COMPLETE` marker - the first to finish wins and the others remove their copy, so readers never see half-written files
+# MAGIC * setup notebooks return the shared directory as `dataset_path`, so users read raw files from there and only write into their own folder
+# MAGIC 
+# MAGIC For a new user `ensure_shared_datasets` is only a couple of metadata checks. The shared files must be treated as read-only - copy a file into the user folder before changing it.
+
+# COMMAND ----------
+
+import hashlib
+import json
+import os
+import uuid
+import zipfile
+
+shared_dataset_root = "dbfs:/FileStore/apjuice_shared/datasets/"
+# archive digests on this driver, by path, size and modification time
+dataset_digest_cache_file = "/tmp/apjuice_dataset_digests.json"
+
+
+def _file_digest(archive):
+    file_digest = hashlib.sha256()
+    with open(archive, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            file_digest.update(chunk)
+    return file_digest.hexdigest()
+
+
+def archive_digest(archives):
+    # hashing the archives is the slowest part of the setup - only re-hash an archive when its size or mtime changed
+    try:
+        with open(dataset_digest_cache_file) as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        cache = {}
+
+    digest = hashlib.sha256()
+    for archive in sorted(archives):
+        stat = os.stat(archive)
+        key = f"{archive}:{stat.st_size}:{stat.st_mtime_ns}"
+        if key not in cache:
+            cache[key] = _file_digest(archive)
+        digest.update(f"{os.path.basename(archive)}:{cache[key]}|".encode())
+
+    with open(f"{dataset_digest_cache_file}.tmp", "w") as f:
+        json.dump(cache, f)
+    os.replace(f"{dataset_digest_cache_file}.tmp", dataset_digest_cache_file)
+    return digest.hexdigest()
+
+
+def _exists(path):
+    try:
+        dbutils.fs.ls(path)
+        return True
+    except Exception:
+        return False
+
+
+def _published_path(marker):
+    if not _exists(marker):
+        return None
+    return json.loads(dbutils.fs.head(marker))["path"]
+
+# COMMAND ----------
+
+def ensure_shared_datasets(archives, root=shared_dataset_root):
+    digest = archive_digest(archives)
+    digest_path = f"{root}{digest[:16]}/"
+    marker = f"{digest_path}_COMPLETE"
+
+    dataset_path = _published_path(marker)
+    if dataset_path is not None:
+        return dataset_path
+
+    # every setup extracts into its own directory and the first one to finish publishes it in the marker,
+    # so users never read files another setup is still writing
+    extract_path = f"{digest_path}{uuid.uuid4().hex[:12]}/"
+    local_path = extract_path.replace("dbfs:/", "/dbfs/")
+    os.makedirs(local_path, exist_ok=True)
+    for archive in archives:
+        with zipfile.ZipFile(archive, "r") as zip_ref:
+            zip_ref.extractall(local_path)
+
+    try:
+        dbutils.fs.put(marker, json.dumps({"digest": digest, "archives": [os.path.basename(a) for a in archives], "path": extract_path}), False)
+    except Exception:
+        # another setup published the same archives first
+        dbutils.fs.rm(extract_path, True)
+    return _published_path(marker)
+
+
+def copy_user_datasets(dataset_path, user_path, datasets):
+    # copy-on-write for the few files that have to live in the user folder (e.g. DLT pipeline inputs)
+    for dataset in datasets:
+        if not _exists(f"{user_path}{dataset}"):
+            dbutils.fs.cp(f"{dataset_path}{dataset}", f"{user_path}{dataset}")
@@ -1,5 +1,5 @@
 # Databricks notebook source
-# MAGIC %run ./Fetch-User-Metadata
+# MAGIC %run ./Bootstrap
 
 # COMMAND ----------
 
@@ -9,6 +9,17 @@ uc_status= dbutils.widgets.get("uc_status")
 
 # COMMAND ----------
 
+# reuses the session already resolved by the calling notebook
+session = bootstrap(uc_status)
+
+database_name = session["database_name"]
+catalog_name = session["catalog_name"]
+username = session["username"]
+base_table_path = session["dbfs_data_path"]
+dataset_path = session["dataset_path"]
+
+# COMMAND ----------
+
 
 if uc_status =='Enabled':
   spark.sql(f"CREATE CATALOG IF NOT EXISTS {catalog_name};")
@@ -17,17 +28,28 @@ if uc_status =='Enabled':
 # COMMAND ----------
 
 
-spark.sql(f"CREATE DATABASE IF NOT EXISTS {database_name}_aux")
+# jan_sales is only needed by the data generators below, so it is created on first use
+_jan_sales_ready = False
+
+
+def ensure_jan_sales():
+    global _jan_sales_ready
+    if _jan_sales_ready:
+        return
+
+    if not spark.catalog.tableExists(f"{database_name}_aux.jan_sales"):
+        spark.sql(f"CREATE DATABASE IF NOT EXISTS {database_name}_aux")
 
-spark.read.json(f"{base_table_path}sales_202201.json").createOrReplaceTempView('jan_sales_view')
+        spark.read.json(f"{dataset_path}sales_202201.json").createOrReplaceTempView('jan_sales_view')
 
-spark.sql(f"""
-CREATE TABLE IF NOT EXISTS {database_name}_aux.jan_sales
-AS 
-SELECT *, from_unixtime(ts, "yyyy-MM-dd") as ts_date 
-FROM jan_sales_view
-ORDER BY from_unixtime(ts, "yyyy-MM-dd")
-""")
+        spark.sql(f"""
+        CREATE TABLE IF NOT EXISTS {database_name}_aux.jan_sales
+        AS 
+        SELECT *, from_unixtime(ts, "yyyy-MM-dd") as ts_date 
+        FROM jan_sales_view
+        ORDER BY from_unixtime(ts, "yyyy-MM-dd")
+        """)
+    _jan_sales_ready = True
 
 # COMMAND ----------
 
@@ -37,6 +59,7 @@ import time
 def get_incremental_data(ingest_path, location, date):
     if uc_status == "Enabled":
         spark.sql(f"USE CATALOG {catalog_name}")
+    ensure_jan_sales()
     df = spark.sql(
         f"""
   select CustomerID, Location, OrderSource, PaymentMethod, STATE, SaleID, SaleItems, ts, unix_timestamp() as exported_ts from {database_name}_aux.jan_sales
@@ -54,6 +77,7 @@ where location = '{location}' and ts_date = '{date}'
 def get_fixed_records_data(ingest_path, location, date):
     if uc_status == "Enabled":
         spark.sql(f"USE CATALOG {catalog_name}")
+    ensure_jan_sales()
     df = spark.sql(
         f"""
   select CustomerID, Location, OrderSource, PaymentMethod, 'CANCELED' as STATE, SaleID, SaleItems, from_unixtime(ts) as ts, unix_timestamp() as exported_ts from {database_name}_aux.jan_sales
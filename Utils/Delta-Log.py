@@ -0,0 +1,211 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Delta Log Reader
+# MAGIC 
+# MAGIC Reads table metadata straight from `_delta_log` (json commits and parquet checkpoints) with plain Python, without starting a Spark job:
+# MAGIC * `delta_snapshot` - active files, metadata and protocol of a table version
+# MAGIC * `delta_table_stats` - number of files, size and row count (from file stats) of a snapshot
+# MAGIC * `delta_file_diff` - files added and removed between two versions, with the version of every file change
+# MAGIC * `delta_history` - commit info of every version still in the log
+# MAGIC 
+# MAGIC Paths can be given as `dbfs:/...` (read through the `/dbfs` mount) or local paths - `delta_log_readable` tells whether a table location qualifies. Tables on cloud storage locations (e.g. Unity Catalog managed tables) have to be inspected with Spark. Checkpoints need `pyarrow`.
+
+# COMMAND ----------
+
+import json
+import os
+import re
+
+
+def delta_log_readable(table_path):
+    # cloud storage locations of Unity Catalog tables (s3://, abfss://, gs://) are not mounted on the driver
+    return table_path.startswith("dbfs:/") or table_path.startswith("/")
+
+
+def _local_path(path):
+    if path.startswith("dbfs:/"):
+        return "/dbfs/" + path[len("dbfs:/"):]
+    if not delta_log_readable(path):
+        raise ValueError(f"{path} is not on DBFS or a local path - use DESCRIBE DETAIL / DESCRIBE HISTORY for it")
+    return path
+
+
+def _log_dir(table_path):
+    return os.path.join(_local_path(table_path), "_delta_log")
+
+
+def _file_key(action):
+    # a file can be re-added with a new deletion vector, so the vector is part of the file identity
+    dv = action.get("deletionVector")
+    if not dv:
+        return action["path"]
+    return f"{action['path']}#{dv['storageType']}{dv['pathOrInlineDv']}@{dv.get('offset')}"
+
+
+def _commit_versions(log_dir):
+    return sorted(int(name[:20]) for name in os.listdir(log_dir) if re.fullmatch(r"\d{20}\.json", name))
+
+
+def _commit_actions(log_dir, version):
+    path = os.path.join(log_dir, f"{version:020d}.json")
+    if not os.path.exists(path):
+        raise ValueError(f"Commit {version} is no longer in {log_dir} - it was removed by log retention")
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# COMMAND ----------
+
+def _checkpoints(log_dir):
+    checkpoints = {}
+    for name in os.listdir(log_dir):
+        match = re.fullmatch(r"(\d{20})\.checkpoint(?:\.\d{10}\.(\d{10}))?\.parquet", name)
+        if match:
+            checkpoints.setdefault(int(match.group(1)), []).append(name)
+
+    # only keep checkpoints with all their parts written
+    complete = {}
+    for version, names in checkpoints.items():
+        parts = re.fullmatch(r"\d{20}\.checkpoint(?:\.\d{10}\.(\d{10}))?\.parquet", names[0]).group(1)
+        if parts is None or len(names) == int(parts):
+            complete[version] = sorted(names)
+    return complete
+
+
+def _as_json_value(value, arrow_type):
+    import pyarrow as pa
+
+    # Arrow returns maps as lists of (key, value) tuples, json commits have objects
+    if value is None:
+        return None
+    if pa.types.is_map(arrow_type):
+        return {k: _as_json_value(v, arrow_type.item_type) for k, v in value}
+    if pa.types.is_struct(arrow_type):
+        return {field.name: _as_json_value(value[field.name], field.type) for field in arrow_type}
+    if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+        return [_as_json_value(v, arrow_type.value_type) for v in value]
+    return value
+
+
+def _checkpoint_actions(log_dir, names):
+    import pyarrow.parquet as pq
+
+    actions = []
+    for name in names:
+        table = pq.read_table(os.path.join(log_dir, name))
+        for row in table.to_pylist():
+            actions.append({
+                field.name: _as_json_value(row[field.name], field.type)
+                for field in table.schema if row[field.name] is not None
+            })
+    return actions
+
+# COMMAND ----------
+
+def delta_snapshot(table_path, version=None):
+    log_dir = _log_dir(table_path)
+    commit_versions = _commit_versions(log_dir)
+    checkpoints = _checkpoints(log_dir)
+
+    if version is None:
+        version = max(commit_versions + list(checkpoints))
+
+    snapshot = {"version": version, "files": {}, "metadata": None, "protocol": None}
+
+    start_version = 0
+    usable_checkpoints = [v for v in checkpoints if v <= version]
+    if usable_checkpoints:
+        checkpoint_version = max(usable_checkpoints)
+        _apply_actions(snapshot, _checkpoint_actions(log_dir, checkpoints[checkpoint_version]))
+        start_version = checkpoint_version + 1
+
+    for commit_version in range(start_version, version + 1):
+        _apply_actions(snapshot, _commit_actions(log_dir, commit_version))
+    return snapshot
+
+
+def _apply_actions(snapshot, actions):
+    for action in actions:
+        if "add" in action:
+            snapshot["files"][_file_key(action["add"])] = action["add"]
+        elif "remove" in action:
+            snapshot["files"].pop(_file_key(action["remove"]), None)
+        elif "metaData" in action:
+            snapshot["metadata"] = action["metaData"]
+        elif "protocol" in action:
+            snapshot["protocol"] = action["protocol"]
+
+
+def _num_records(add):
+    stats = add.get("stats")
+    if not stats:
+        return None
+    num_records = json.loads(stats).get("numRecords")
+    if num_records is None:
+        return None
+    return num_records - (add.get("deletionVector") or {}).get("cardinality", 0)
+
+
+def delta_table_stats(snapshot):
+    files = snapshot["files"].values()
+    records = [_num_records(add) for add in files]
+    return {
+        "version": snapshot["version"],
+        "num_files": len(files),
+        "size_bytes": sum(add.get("size", 0) for add in files),
+        # None when some files were written without stats
+        "num_records": None if None in records else sum(records),
+        "num_deleted_records": sum((add.get("deletionVector") or {}).get("cardinality", 0) for add in files),
+    }
+
+# COMMAND ----------
+
+def delta_file_diff(table_path, from_version, to_version=None):
+    log_dir = _log_dir(table_path)
+    if to_version is None:
+        to_version = max(_commit_versions(log_dir))
+
+    added, removed = {}, {}
+    # version that added / removed each file and commit timestamps (ms), so changes can be ordered
+    versions, timestamps = {}, {}
+    for version in range(from_version + 1, to_version + 1):
+        for action in _commit_actions(log_dir, version):
+            if "add" in action:
+                key = _file_key(action["add"])
+                if key in removed:
+                    del removed[key]
+                else:
+                    added[key] = action["add"]
+                    versions[key] = version
+            elif "remove" in action:
+                key = _file_key(action["remove"])
+                if key in added:
+                    del added[key]
+                else:
+                    removed[key] = action["remove"]
+                    versions[key] = version
+            elif "commitInfo" in action:
+                timestamps[version] = action["commitInfo"].get("timestamp")
+
+    return {
+        "from_version": from_version,
+        "to_version": to_version,
+        "added": list(added.values()),
+        "removed": list(removed.values()),
+        "file_versions": {key: versions[key] for key in list(added) + list(removed)},
+        "commit_timestamps": timestamps,
+    }
+
+
+def delta_history(table_path):
+    log_dir = _log_dir(table_path)
+    history = []
+    for version in _commit_versions(log_dir):
+        commit_info = next((a["commitInfo"] for a in _commit_actions(log_dir, version) if "commitInfo" in a), {})
+        history.append({"version": version, **commit_info})
+    return history
+
+
+def delta_table_path(table_name):
+    # the only helper that needs Spark - resolve it once and reuse the path
+    return spark.sql(f"DESCRIBE DETAIL {table_name}").first()["location"]
@@ -0,0 +1,84 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Dimension Loader
+# MAGIC 
+# MAGIC Loads dimension tables from a declarative config. Each dimension is a dict with:
+# MAGIC * `name` - silver dimension table
+# MAGIC * `bronze_table` - bronze table the raw file is loaded into
+# MAGIC * `source`, `format`, `options` - source file and reader settings
+# MAGIC * `silver_sql` - query building the dimension from `{bronze_table}`, run on the driver when its inputs are small (see `Utils/Local-Engine`)
+# MAGIC * `lookup_tables` - optional tables joined in `silver_sql`, a change in them also triggers a reload
+# MAGIC 
+# MAGIC Dimensions are independent, so `load_dimensions` submits them concurrently and skips the ones whose inputs are unchanged (see `Utils/Provisioning`).
+# MAGIC 
+# MAGIC Store to country mapping is kept in `store_country_codes` only and published as the small `store_countries` lookup table (or a json file for DLT).
+
+# COMMAND ----------
+
+# MAGIC %run ./Local-Engine
+
+# COMMAND ----------
+
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+store_country_codes = {
+    "SYD01": "AUS",
+    "MEL01": "AUS",
+    "MEL02": "AUS",
+    "BNE02": "AUS",
+    "PER01": "AUS",
+    "CBR01": "AUS",
+    "AKL01": "NZL",
+    "AKL02": "NZL",
+    "WLG01": "NZL",
+}
+
+
+def create_store_countries_table(table_name="store_countries"):
+    rows = sorted(store_country_codes.items())
+
+    # keep the table version stable when the mapping did not change, so dependent dimensions are not reloaded
+    if spark.catalog.tableExists(table_name) and sorted(tuple(r) for r in spark.table(table_name).collect()) == rows:
+        return False
+
+    spark.createDataFrame(rows, "id string, country_code string") \
+      .write \
+      .mode("overwrite") \
+      .option("overwriteSchema", "true") \
+      .saveAsTable(table_name)
+    return True
+
+
+def write_store_countries_file(path):
+    content = "\n".join(json.dumps({"id": store_id, "country_code": country_code}) for store_id, country_code in sorted(store_country_codes.items()))
+    dbutils.fs.put(path, content, True)
+
+# COMMAND ----------
+
+def load_dimension(dimension):
+    def build():
+        spark.read \
+          .format(dimension["format"]) \
+          .options(**dimension.get("options", {})) \
+          .load(dimension["source"]) \
+          .write \
+          .mode("overwrite") \
+          .option("overwriteSchema", "true") \
+          .saveAsTable(dimension["bronze_table"])
+
+        silver_sql = dimension["silver_sql"].format(bronze_table=dimension["bronze_table"])
+        write_query(dimension["name"], silver_sql, [dimension["bronze_table"], *dimension.get("lookup_tables", [])])
+
+    return provision(dimension["name"], build, paths=[dimension["source"]], tables=dimension.get("lookup_tables", []))
+
+
+def load_dimensions(dimensions, max_workers=4):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(load_dimension, dimension): dimension["name"] for dimension in dimensions}
+        results = {futures[future]: future.result() for future in as_completed(futures)}
+
+    for name, reloaded in results.items():
+        print(f"{name}: {'loaded' if reloaded else 'unchanged'}")
+    return results
@@ -0,0 +1,163 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Dimension Lookup
+# MAGIC 
+# MAGIC Serves point lookups on dimension tables (customer name / email by `unique_customer_id`, country by store id) from local snapshot files instead of a Spark query per lookup:
+# MAGIC * `refresh_lookup_snapshots` - exports the key and value columns of every table in `lookup_dimensions` as an Arrow IPC file sorted by key (see `Utils/Arrow-Export`), only when the Delta version of the table changed
+# MAGIC * `lookup(table_name, key)` - opens the current snapshot memory-mapped, finds the key by binary search on the mapped key column and keeps the last `lookup_hot_set_size` results in an LRU cache
+# MAGIC * `customer_details` / `store_country` - lookups used by the serving layer
+# MAGIC 
+# MAGIC Lookups only read files under `lookup_snapshot_path` on the driver's local disk (not `/dbfs`, where renames are not atomic and mapped pages are read from cloud storage), they never start a Spark job. Snapshots are exported again after a cluster restart. A `_CURRENT` file per table points to the snapshot of the latest table version and is checked at most every `lookup_refresh_seconds`, so readers switch to a new snapshot without a restart. Requires `table_version` from `Utils/Provisioning` to export.
+
+# COMMAND ----------
+
+# MAGIC %run ./Arrow-Export
+
+# COMMAND ----------
+
+import bisect
+import json
+import os
+import tempfile
+import time
+from functools import lru_cache
+
+# driver local disk - /local_disk0 on Databricks clusters
+lookup_snapshot_root = "/local_disk0/tmp" if os.path.isdir("/local_disk0") else tempfile.gettempdir()
+lookup_snapshot_path = f"{lookup_snapshot_root}/apjuice_lookups/{database_name}/"
+lookup_refresh_seconds = 30
+lookup_hot_set_size = 100000
+
+lookup_dimensions = {
+    "dim_customers": {"key": "unique_id", "columns": ["name", "email"]},
+    "dim_locations": {"key": "id", "columns": ["country_code"]},
+}
+
+
+def _current_file(table_name):
+    return f"{lookup_snapshot_path}{table_name}/_CURRENT"
+
+
+def _read_current(table_name):
+    try:
+        with open(_current_file(table_name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# COMMAND ----------
+
+def export_lookup_snapshot(table_name):
+    dimension = lookup_dimensions[table_name]
+    version = table_version(table_name)
+    snapshot_file = f"{lookup_snapshot_path}{table_name}/v{version}.arrow"
+
+    spark.table(table_name) \
+      .select(dimension["key"], *dimension["columns"]) \
+      .where(f"{dimension['key']} is not null") \
+      .orderBy(dimension["key"]) \
+      .createOrReplaceTempView(f"{table_name}_lookup_export")
+    export_arrow_file(f"{table_name}_lookup_export", snapshot_file)
+
+    # switch readers over with an atomic rename of the pointer file
+    with open(f"{_current_file(table_name)}.tmp", "w") as f:
+        json.dump({"version": version, "file": snapshot_file}, f)
+    os.replace(f"{_current_file(table_name)}.tmp", _current_file(table_name))
+
+    # keep the previous snapshot, readers may still have it mapped
+    snapshots = sorted(
+        (name for name in os.listdir(os.path.dirname(snapshot_file)) if name.endswith(".arrow")),
+        key=lambda name: int(name[1:-len(".arrow")])
+    )
+    for name in snapshots[:-2]:
+        os.remove(f"{lookup_snapshot_path}{table_name}/{name}")
+    return snapshot_file
+
+
+def refresh_lookup_snapshots(table_names=None):
+    refreshed = []
+    for table_name in table_names or lookup_dimensions:
+        current = _read_current(table_name)
+        if current is None or current["version"] != table_version(table_name):
+            export_lookup_snapshot(table_name)
+            refreshed.append(table_name)
+    return refreshed
+
+# COMMAND ----------
+
+# keep the open snapshots when this notebook is %run again
+_lookup_snapshots = globals().get("_lookup_snapshots", {})
+_lookup_checks = globals().get("_lookup_checks", {})
+
+
+def _snapshot_version(table_name):
+    # the pointer file is only read every lookup_refresh_seconds
+    checked_at, version = _lookup_checks.get(table_name, (0, None))
+    if time.time() - checked_at < lookup_refresh_seconds:
+        return version
+
+    current = _read_current(table_name)
+    if current is None:
+        raise ValueError(f"No lookup snapshot for {table_name} - run refresh_lookup_snapshots first")
+    if (table_name, current["version"]) not in _lookup_snapshots:
+        table = read_arrow_file(current["file"])
+        _lookup_snapshots[(table_name, current["version"])] = (table, _key_index(table.column(lookup_dimensions[table_name]["key"])))
+        # keep the previous version open for lookups still running on it
+        for key in [key for key in _lookup_snapshots if key[0] == table_name and key[1] not in (version, current["version"])]:
+            del _lookup_snapshots[key]
+    _lookup_checks[table_name] = (time.time(), current["version"])
+    return current["version"]
+
+
+def _key_index(keys):
+    # only the last key of every chunk is copied to Python, the keys themselves stay in the mapped file
+    chunks, offsets, last_keys = [], [], []
+    offset = 0
+    for chunk in keys.chunks:
+        if len(chunk):
+            chunks.append(chunk)
+            offsets.append(offset)
+            last_keys.append(chunk[len(chunk) - 1].as_py())
+        offset += len(chunk)
+    return chunks, offsets, last_keys
+
+
+def _find_key(key_index, key):
+    chunks, offsets, last_keys = key_index
+    c = bisect.bisect_left(last_keys, key)
+    if c == len(chunks):
+        return None
+
+    chunk = chunks[c]
+    low, high = 0, len(chunk) - 1
+    while low < high:
+        middle = (low + high) // 2
+        if chunk[middle].as_py() < key:
+            low = middle + 1
+        else:
+            high = middle
+    return offsets[c] + low if chunk[low].as_py() == key else None
+
+
+@lru_cache(maxsize=lookup_hot_set_size)
+def _lookup_version(table_name, version, key):
+    table, key_index = _lookup_snapshots[(table_name, version)]
+    i = _find_key(key_index, key)
+    if i is None:
+        return None
+    return {column: table.column(column)[i].as_py() for column in lookup_dimensions[table_name]["columns"]}
+
+
+def lookup(table_name, key):
+    # the snapshot version is part of the cache key, so results of an older snapshot are never returned
+    return _lookup_version(table_name, _snapshot_version(table_name), key)
+
+
+def customer_details(unique_customer_id):
+    return lookup("dim_customers", unique_customer_id)
+
+
+def store_country(store_id):
+    details = lookup("dim_locations", store_id)
+    return None if details is None else details["country_code"]
@@ -0,0 +1,102 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Expectations
+# MAGIC 
+# MAGIC Data quality rules for the batch medallion path, similar to the `CONSTRAINT ... EXPECT` clauses of the DLT pipeline. Each rule is a dict with:
+# MAGIC * `name` - rule description, reported in metrics and quarantined rows
+# MAGIC * `expr` - SQL expression that is true for valid rows (null counts as a violation)
+# MAGIC * `action` - `warn` keeps the row, `drop` removes it, `quarantine` moves it to the quarantine table and `fail` stops the write
+# MAGIC 
+# MAGIC `apply_expectations` evaluates all rules in one pass: every row gets the array of rules it failed and the per rule counts are collected with an `Observation` while the rows are cached. Valid and quarantined rows are then written from the cached result, so rules do not rescan the source. Quarantined rows are merged into the quarantine table on `quarantine_keys`, so re-checking the same rows on the next run does not add them again.
+
+# COMMAND ----------
+
+import pyspark.sql.functions as F
+from pyspark.sql import Observation
+
+expectation_actions = ["warn", "drop", "quarantine", "fail"]
+
+silver_sales_expectations = [
+    {"name": "Location has to be 5 characters long", "expr": "length(store_id) = 5", "action": "quarantine"},
+    {"name": "Only CANCELED and COMPLETED transactions are allowed", "expr": "order_state IN ('CANCELED', 'COMPLETED')", "action": "warn"},
+]
+
+silver_sale_items_expectations = [
+    {"name": "Location has to be 5 characters long", "expr": "length(store_id) = 5", "action": "quarantine"},
+    {"name": "All custom juice must have ingredients", "expr": "NOT(product_id = 'Custom' and size(product_ingredients) = 0)", "action": "warn"},
+]
+
+
+def _failed_rules(rules):
+    checks = [F.when(~F.coalesce(F.expr(rule["expr"]), F.lit(False)), F.lit(rule["name"])) for rule in rules]
+    return F.filter(F.array(*checks), lambda name: name.isNotNull())
+
+
+def _fails_any(rules):
+    names = [rule["name"] for rule in rules]
+    if not names:
+        return F.lit(False)
+    return F.arrays_overlap(F.col("_failed_expectations"), F.array(*[F.lit(name) for name in names]))
+
+# COMMAND ----------
+
+def _quarantine(rows, quarantine_table, keys):
+    rows = rows.withColumn("_quarantined_at", F.current_timestamp())
+    if not spark.catalog.tableExists(quarantine_table):
+        rows.write.saveAsTable(quarantine_table)
+        return
+
+    # the same source rows are checked on every run - keep one row per key, with the time it was first quarantined
+    view = f"{quarantine_table.split('.')[-1]}_batch"
+    rows.createOrReplaceTempView(view)
+    updates = ", ".join(f"`{c}` = source.`{c}`" for c in rows.columns if c != "_quarantined_at")
+    spark.sql(f"""
+    merge with schema evolution into {quarantine_table} target
+      using {view} source
+      on {" and ".join(f"target.`{k}` = source.`{k}`" for k in keys)}
+    when matched then
+      update set {updates}
+    when not matched then
+      insert *
+    """)
+
+
+def apply_expectations(df, rules, write, quarantine_table=None, quarantine_keys=("id",)):
+    unknown = [rule["name"] for rule in rules if rule["action"] not in expectation_actions]
+    if unknown:
+        raise ValueError(f"Unknown expectation action in {unknown} - use one of {expectation_actions}")
+    if quarantine_table is None and any(rule["action"] == "quarantine" for rule in rules):
+        raise ValueError("Rules with the quarantine action need a quarantine_table")
+
+    observation = Observation()
+    checked = df.withColumn("_failed_expectations", _failed_rules(rules))
+    checked = checked.observe(
+        observation,
+        F.count(F.lit(1)).alias("rows"),
+        *[F.sum(F.array_contains("_failed_expectations", rule["name"]).cast("long")).alias(rule["name"]) for rule in rules],
+    ).persist()
+
+    try:
+        checked.count()
+        metrics = observation.get
+        failed = {rule["name"]: metrics[rule["name"]] or 0 for rule in rules}
+
+        for rule in rules:
+            print(f"{rule['name']} ({rule['action']}): {metrics['rows'] - failed[rule['name']]} passed, {failed[rule['name']]} failed")
+
+        failing = [rule["name"] for rule in rules if rule["action"] == "fail" and failed[rule["name"]]]
+        if failing:
+            raise ValueError(f"Expectations failed: {failing}")
+
+        quarantined = _fails_any([rule for rule in rules if rule["action"] == "quarantine"])
+        dropped = _fails_any([rule for rule in rules if rule["action"] == "drop"])
+
+        if quarantine_table is not None and any(failed[rule["name"]] for rule in rules if rule["action"] == "quarantine"):
+            _quarantine(checked.where(quarantined), quarantine_table, quarantine_keys)
+
+        write(checked.where(~quarantined & ~dropped).drop("_failed_expectations"))
+    finally:
+        checked.unpersist()
+
+    return {"rows": metrics["rows"], "failed": failed}
@@ -1,27 +1,48 @@
 # Databricks notebook source
-# MAGIC %scala
-# MAGIC spark.conf.set("com.databricks.training.module_name", "ap_juice")
-# MAGIC val dbNamePrefix = {
-# MAGIC   val tags = com.databricks.logging.AttributionContext.current.tags
-# MAGIC   val name = tags.getOrElse(com.databricks.logging.BaseTagDefinitions.TAG_USER, java.util.UUID.randomUUID.toString.replace("-", ""))
-# MAGIC   val username = if (name != "unknown") name else dbutils.widgets.get("databricksUsername")
-# MAGIC   
-# MAGIC   val username_final = username.split('@')(0)
-# MAGIC   val module_name = spark.conf.get("com.databricks.training.module_name").toLowerCase()
-# MAGIC 
-# MAGIC   val databaseName = (username_final+"_"+module_name).replaceAll("[^a-zA-Z0-9]", "_") + "_db"
-# MAGIC   val catalogName = (username_final+"_Workshop").replaceAll("[^a-zA-Z0-9]", "_") 
-# MAGIC   spark.conf.set("com.databricks.training.spark.dbName", databaseName)
-# MAGIC   spark.conf.set("com.databricks.training.spark.catalogName", catalogName)
-# MAGIC   spark.conf.set("com.databricks.training.spark.userName", username_final)
-# MAGIC   databaseName
-# MAGIC }
+import getpass
+import json
+import os
+import re
+import uuid
+
+module_name = "ap_juice"
+
+# keep resolved names when this notebook is %run again in the same session
+_user_metadata_cache = globals().get("_user_metadata_cache", {})
+
+
+def _current_username():
+    if "DATABRICKS_RUNTIME_VERSION" not in os.environ:
+        # not running on a Databricks cluster - use the local user
+        return getpass.getuser()
+    try:
+        tags = json.loads(dbutils.notebook.entry_point.getDbutils().notebook().getContext().toJson()).get("tags", {})
+    except Exception:
+        # shared access mode clusters refuse the context call - every user runs as the same OS user there
+        return spark.sql("select current_user()").first()[0]
+
+    name = tags.get("user", uuid.uuid4().hex)
+    return name if name != "unknown" else dbutils.widgets.get("databricksUsername")
+
+
+def resolve_user_metadata(module_name=module_name):
+    if module_name not in _user_metadata_cache:
+        username_final = _current_username().split("@")[0]
+
+        _user_metadata_cache[module_name] = {
+            "database_name": re.sub("[^a-zA-Z0-9]", "_", f"{username_final}_{module_name.lower()}") + "_db",
+            "catalog_name": re.sub("[^a-zA-Z0-9]", "_", f"{username_final}_Workshop"),
+            "username": username_final.replace(".", "_"),
+        }
+    return _user_metadata_cache[module_name]
 
 # COMMAND ----------
 
-database_name = spark.conf.get("com.databricks.training.spark.dbName")
-catalog_name = spark.conf.get("com.databricks.training.spark.catalogName")
-username = spark.conf.get("com.databricks.training.spark.userName").replace('.', '_')
+user_metadata = resolve_user_metadata()
+
+database_name = user_metadata["database_name"]
+catalog_name = user_metadata["catalog_name"]
+username = user_metadata["username"]
 
 displayHTML("""Username is <b style="color:green">{}</b>""".format(username))
 
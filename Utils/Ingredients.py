@@ -0,0 +1,123 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Ingredients
+# MAGIC 
+# MAGIC Ingredient level tables, so ingredient questions do not explode `product_ingredients` of every item row:
+# MAGIC * `dim_ingredients` - one integer `ingredient_id` per ingredient, ids of known ingredients never change
+# MAGIC * `silver_sale_item_ingredients` - bridge of item keys to ingredient ids, partitioned by sales month and store and Z-ordered by `ingredient_id` within each partition so file statistics skip files without the ingredient
+# MAGIC * `silver_ingredient_bitmaps` - one bitmap of ingredient ids per store and sales month (`bitmap_construct_agg`)
+# MAGIC 
+# MAGIC `items_with_ingredient` first checks the small bitmap table on the driver and then only reads the bridge partitions of the stores and months that contain the ingredient.
+
+# COMMAND ----------
+
+# MAGIC %run ./Stage-Tuning
+
+# COMMAND ----------
+
+from functools import reduce
+
+import pyspark.sql.functions as F
+from pyspark.sql.window import Window
+
+# number of bits in one bitmap, see bitmap_bucket_number / bitmap_bit_position
+ingredient_bitmap_bits = 32768
+
+
+def update_dim_ingredients():
+    ingredients = spark.table("silver_sale_items") \
+      .select(F.explode("product_ingredients").alias("ingredient")) \
+      .where(F.col("ingredient").isNotNull()) \
+      .distinct()
+
+    max_id = 0
+    if spark.catalog.tableExists("dim_ingredients"):
+        known = spark.table("dim_ingredients")
+        max_id = known.agg(F.max("ingredient_id")).first()[0] or 0
+        ingredients = ingredients.join(known, "ingredient", "left_anti")
+
+    # only new ingredients are appended, so ids already used in the bridge table stay valid
+    ingredients \
+      .withColumn("ingredient_id", (F.row_number().over(Window.orderBy("ingredient")) + max_id).cast("int")) \
+      .select("ingredient_id", "ingredient") \
+      .write \
+      .mode("append") \
+      .saveAsTable("dim_ingredients")
+
+# COMMAND ----------
+
+def build_sale_item_ingredients():
+    spark.sql(f"""
+    create or replace table silver_sale_item_ingredients
+    partitioned by (sales_month, store_id)
+    {tblproperties_clause("silver_sale_item_ingredients")}
+    as
+    with item_ingredients as (
+      select sale_item_key, sale_key, store_id, sales_month, explode(array_distinct(product_ingredients)) as ingredient
+      from silver_sale_items
+    )
+    select /*+ BROADCAST(d) */ i.sale_item_key, i.sale_key, i.store_id, i.sales_month, d.ingredient_id
+    from item_ingredients i
+      join dim_ingredients d on i.ingredient = d.ingredient
+    """)
+    spark.sql("OPTIMIZE silver_sale_item_ingredients ZORDER BY (ingredient_id)")
+
+    spark.sql(f"""
+    create or replace table silver_ingredient_bitmaps
+    {tblproperties_clause("silver_ingredient_bitmaps")}
+    as
+    select store_id, sales_month, bitmap_bucket_number(ingredient_id) as bucket, bitmap_construct_agg(bitmap_bit_position(ingredient_id)) as ingredients
+    from silver_sale_item_ingredients
+    group by store_id, sales_month, bitmap_bucket_number(ingredient_id)
+    """)
+
+
+def build_ingredient_index():
+    update_dim_ingredients()
+    build_sale_item_ingredients()
+
+# COMMAND ----------
+
+def _has_bit(bitmap, position):
+    byte = position // 8
+    return byte < len(bitmap) and bool(bitmap[byte] & (1 << position % 8))
+
+
+def ingredient_id(ingredient):
+    row = spark.table("dim_ingredients").where(F.col("ingredient") == ingredient).first()
+    return row.ingredient_id if row else None
+
+
+def _ingredient_partitions(ingredient_key, store_id=None, sales_month=None):
+    bitmaps = spark.table("silver_ingredient_bitmaps") \
+      .where(F.col("bucket") == (ingredient_key - 1) // ingredient_bitmap_bits + 1)
+    if store_id is not None:
+        bitmaps = bitmaps.where(F.col("store_id") == store_id)
+    if sales_month is not None:
+        bitmaps = bitmaps.where(F.col("sales_month") == sales_month)
+
+    position = (ingredient_key - 1) % ingredient_bitmap_bits
+    return [(r.store_id, r.sales_month) for r in bitmaps.collect() if _has_bit(r.ingredients, position)]
+
+
+def ingredient_partitions(ingredient, store_id=None, sales_month=None):
+    ingredient_key = ingredient_id(ingredient)
+    if ingredient_key is None:
+        return []
+    return _ingredient_partitions(ingredient_key, store_id, sales_month)
+
+
+def items_with_ingredient(ingredient, store_id=None, sales_month=None):
+    bridge = spark.table("silver_sale_item_ingredients")
+    ingredient_key = ingredient_id(ingredient)
+    partitions = [] if ingredient_key is None else _ingredient_partitions(ingredient_key, store_id, sales_month)
+    if not partitions:
+        return bridge.limit(0)
+
+    # exact (store, month) pairs, so only the partitions holding the ingredient are listed and read
+    in_partitions = reduce(
+        lambda a, b: a | b,
+        [(F.col("store_id") == store) & (F.col("sales_month") == month) for store, month in sorted(partitions)]
+    )
+    return bridge.where((F.col("ingredient_id") == ingredient_key) & in_partitions)
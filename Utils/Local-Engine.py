@@ -0,0 +1,126 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Local Engine
+# MAGIC 
+# MAGIC Dimension and gold tables are tiny, but building them with Spark still pays for job scheduling and shuffles. `write_query(target_table, sql, tables)` runs the query with DuckDB on the driver when every input table is small, and only uses Spark to write the (small) result as a Delta table. Otherwise the query runs on Spark as before.
+# MAGIC 
+# MAGIC An input qualifies when it is smaller than `local_engine_max_bytes` and DuckDB can read its files straight from the driver: plain parquet tables on DBFS, with the active files read from `_delta_log` (see `Utils/Delta-Log`) and partition values taken from the `column=value` directories. Tables on cloud storage (e.g. with Unity Catalog) or with deletion vectors or column mapping run on Spark - fetching them to the driver would cost more than the query.
+# MAGIC 
+# MAGIC Queries must use SQL understood by both engines (e.g. `'` for string literals, no `date_format`). Result columns are matched to the schema Spark would produce for the query by name and cast to it, so both paths write the same table - queries with duplicate column names run on Spark. DuckDB is installed on the driver on first use - when that is not possible (e.g. no internet access) everything runs on Spark.
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Log
+
+# COMMAND ----------
+
+# MAGIC %run ./Arrow-Export
+
+# COMMAND ----------
+
+import os
+import subprocess
+import sys
+
+from pyspark.sql.pandas.types import to_arrow_schema
+
+local_engine_enabled = True
+local_engine_max_bytes = 64 * 1024 * 1024
+
+
+# whether DuckDB could be imported, so a failed install is only tried once per session
+_duckdb_available = globals().get("_duckdb_available")
+
+
+def _duckdb():
+    global _duckdb_available
+    if _duckdb_available is False:
+        return None
+    try:
+        import duckdb
+    except ImportError:
+        # not part of the Databricks runtime
+        try:
+            subprocess.run([sys.executable, "-m", "pip", "install", "--quiet", "duckdb"], check=True)
+            import duckdb
+        except Exception as e:
+            print(f"DuckDB not available, queries run on Spark: {e}")
+            _duckdb_available = False
+            return None
+    _duckdb_available = True
+    return duckdb
+
+
+def _local_input(table_name):
+    # parquet files DuckDB can read directly from the driver, None when the table has to be read by Spark
+    table_path = delta_table_path(table_name)
+    if not delta_log_readable(table_path):
+        # cloud storage locations (e.g. Unity Catalog) are not mounted on the driver
+        return None
+
+    snapshot = delta_snapshot(table_path)
+    metadata = snapshot["metadata"] or {}
+    files = list(snapshot["files"].values())
+
+    if not files or sum(add.get("size", 0) for add in files) > local_engine_max_bytes:
+        return None
+    if metadata.get("configuration", {}).get("delta.columnMapping.mode", "none") != "none" \
+      or any(add.get("deletionVector") for add in files) \
+      or any(f"{column}=" not in add["path"] for add in files for column in metadata.get("partitionColumns", [])):
+        # not plain hive style parquet - partition values are read from the directory names
+        return None
+    return [os.path.join(_local_path(table_path), add["path"]) for add in files]
+
+# COMMAND ----------
+
+def _run_local(duckdb, sql, table_inputs):
+    connection = duckdb.connect()
+    try:
+        for table_name, files in table_inputs.items():
+            connection.execute(f"create view {table_name} as select * from read_parquet({files!r}, hive_partitioning = true, hive_types_autocast = false)")
+        return connection.execute(sql).fetch_arrow_table()
+    finally:
+        connection.close()
+
+
+def _match_columns(result, schema):
+    # DuckDB puts hive partition columns last, so columns are matched by name - Spark resolves names case insensitively
+    names = {name.lower(): name for name in result.column_names}
+    if len(names) != len(result.column_names) or len(schema.names) != len(result.column_names) \
+      or any(name.lower() not in names for name in schema.names):
+        return None
+    return result.select([names[name.lower()] for name in schema.names]).rename_columns(schema.names).cast(schema)
+
+
+def write_query(target_table, sql, tables):
+    # analysing the query is cheap and gives the schema the Spark path would write
+    query = spark.sql(sql)
+    schema = to_arrow_schema(query.schema)
+
+    duckdb = _duckdb() if local_engine_enabled else None
+    table_inputs = {}
+    if duckdb:
+        for table_name in tables:
+            table_inputs[table_name] = _local_input(table_name)
+            if table_inputs[table_name] is None:
+                break
+
+    result = None
+    if duckdb and all(table_input is not None for table_input in table_inputs.values()):
+        # e.g. duplicate column names from a join - those cannot be matched to the Spark schema
+        result = _match_columns(_run_local(duckdb, sql, table_inputs), schema)
+
+    if result is not None:
+        with arrow_conf():
+            df = spark.createDataFrame(result.to_pandas(), schema=query.schema).coalesce(1)
+        engine = "local"
+    else:
+        df = query
+        engine = "spark"
+
+    df.write \
+      .mode("overwrite") \
+      .option("overwriteSchema", "true") \
+      .saveAsTable(target_table)
+    return engine
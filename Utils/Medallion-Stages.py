@@ -0,0 +1,292 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Medallion Stages
+# MAGIC 
+# MAGIC Table definitions and build steps of the medallion pipeline, shared by the walkthrough in `2 Medaillon architecture` and the scheduled `6 Daily Pipeline` job:
+# MAGIC * `dimensions` - bronze to silver config of the dimension tables, loaded with `load_dimensions` (see `Utils/Dimension-Loader`)
+# MAGIC * `create_bronze_sales_table` / `ingest_bronze_sales` - the Autoloader target and an `availableNow` run of the stream
+# MAGIC * `create_silver_views` - `v_silver_sales` (latest record per sale) and `v_silver_sale_items` (one row per item) over `bronze_sales`
+# MAGIC * `build_silver_sales` / `update_silver_sales` / `build_silver_sale_items` - silver tables written through `apply_expectations`
+# MAGIC * `build_gold_country_sales` - sales per country and month
+# MAGIC * `daily_stages` - all of the above as `run_pipeline` stages (see `Utils/Pipeline-Runner`)
+# MAGIC 
+# MAGIC Requires the session variables (`dataset_path`, `local_data_path`, `autoloader_ingest_path`) and the helper notebooks the walkthrough runs (`Utils/Provisioning`, `Utils/Table-Maintenance`, `Utils/Bronze-Ingest`, `Utils/Dimension-Loader`, `Utils/Top-Customers`, `Utils/Ingredients`, `Utils/Expectations`, `Utils/Surrogate-Keys`, `Utils/Table-Changes`), `daily_stages` also `Utils/Dimension-Lookup`.
+
+# COMMAND ----------
+
+# MAGIC %run ./Stage-Tuning
+
+# COMMAND ----------
+
+dimensions = [
+    {
+        "name": "dim_locations",
+        "bronze_table": "bronze_store_locations",
+        "source": f"{dataset_path}stores.csv",
+        "format": "csv",
+        "options": {"header": "true", "delimiter": ",", "inferSchema": "true"},
+        "silver_sql": """
+          select /*+ BROADCAST(c) */ l.*, c.country_code
+          from {bronze_table} l
+            left join store_countries c on l.id = c.id
+        """,
+        "lookup_tables": ["store_countries"],
+    },
+    {
+        "name": "dim_customers",
+        "bronze_table": "bronze_customers",
+        "source": f"{dataset_path}users.csv",
+        "format": "csv",
+        "options": {"header": "true", "delimiter": ",", "inferSchema": "true"},
+        "silver_sql": """
+          SELECT store_id || '-' || cast(id as string) as unique_id, id, store_id, name, email FROM {bronze_table}
+        """,
+    },
+    {
+        # note that this time our input file is json and not csv
+        "name": "dim_products",
+        "bronze_table": "bronze_products",
+        "source": f"{dataset_path}products.json",
+        "format": "json",
+        "silver_sql": """
+          select * from {bronze_table}
+        """,
+    },
+]
+
+# COMMAND ----------
+
+checkpoint_path = f"{local_data_path}/_checkpoints"
+schema_path = f"{local_data_path}/_schema"
+
+
+def create_bronze_sales_table():
+    spark.sql("""
+    CREATE TABLE IF NOT EXISTS bronze_sales
+    TBLPROPERTIES (
+      delta.autoOptimize.optimizeWrite = true,
+      delta.autoOptimize.autoCompact = true,
+      delta.enableDeletionVectors = true,
+      delta.enableChangeDataFeed = true
+    )
+    """)
+
+    # tables created before these properties were added get them here, all are no-ops when already set
+    enable_optimized_writes("bronze_sales")
+    # corrections on bronze only mark the changed rows, see purge_deletion_vectors in Utils/Table-Maintenance
+    enable_deletion_vectors("bronze_sales")
+    # the changed rows of files with deletion vectors are only known to the change feed, see Utils/Table-Changes
+    enable_change_data_feed("bronze_sales")
+
+
+def ingest_bronze_sales():
+    # process the files that arrived since the last run, then stop
+    read_sales_stream(autoloader_ingest_path, schema_path) \
+      .writeStream \
+      .format("delta") \
+      .option("checkpointLocation", checkpoint_path) \
+      .option("mergeSchema", "true") \
+      .trigger(availableNow=True) \
+      .table("bronze_sales") \
+      .awaitTermination()
+
+# COMMAND ----------
+
+def create_silver_views():
+    spark.sql("""
+    create or replace view v_silver_sales 
+    as 
+    with with_latest_record_id as (
+      select
+        *,
+        row_number() over (
+          partition by SaleID
+          order by
+            coalesce(exported_ts, 0) desc
+        ) as latest_record
+      from
+        bronze_sales
+    ),
+    newest_records as (
+      select
+        saleID as id,
+        timestamp_seconds(ts) as ts,
+        to_date(timestamp_seconds(ts)) as sale_date,
+        date_format(timestamp_seconds(ts), 'yyyy-MM') as sales_month, -- partition column of the silver tables
+        Location as store_id,
+        CustomerID as customer_id,
+        location || "-" || cast(CustomerID as string) as unique_customer_id,
+        OrderSource as order_source,
+        STATE as order_state,
+        SaleItems as sale_items
+      from
+        with_latest_record_id
+      where
+        latest_record = 1
+    )
+    select
+      *,
+      sha2(to_json(struct(*)), 256) as row_hash -- add a hash of all values to easily pick up changed rows, to_json also covers the nested sale_items
+    from
+      newest_records
+    """)
+
+    spark.sql("""
+    create or replace view v_silver_sale_items 
+    as 
+    with itemised_records as (
+      select
+        *,
+        posexplode(sale_items) -- already typed in bronze_sales, no from_json needed
+      from
+        v_silver_sales
+    ),
+    all_records as (
+      select
+        id || "-" || cast(pos as string) as id,
+        id as sale_id,
+        store_id,
+        sale_date,
+        sales_month,
+        pos as item_number,
+        col.id as product_id,
+        col.size as product_size,
+        col.notes as product_notes,
+        col.cost as product_cost,
+        col.ingredients as product_ingredients
+      from
+        itemised_records
+    )
+    select
+      *,
+      sha2(concat_ws(*, '||'), 256) as row_hash
+    from
+      all_records
+    """)
+
+# COMMAND ----------
+
+# stable integer keys used by gold joins instead of the string ids, see Utils/Surrogate-Keys
+silver_sales_keys = {"sale": "id", "customer": "unique_customer_id"}
+silver_sale_items_keys = {"sale_item": "id", "sale": "sale_id"}
+
+
+def silver_tblproperties(table_name):
+    # replacing the table drops its properties, see tblproperties_clause in Utils/Stage-Tuning
+    return tblproperties_clause(table_name, {"delta.enableChangeDataFeed": "true", "delta.enableDeletionVectors": "true"})
+
+
+# silver tables written before typed timestamps, month partitions or surrogate keys cannot be merged into - they are rebuilt instead
+def has_silver_layout(table_name, df):
+    if not spark.catalog.tableExists(table_name):
+        return False
+    table_columns = {(f.name, f.dataType.simpleString()) for f in spark.table(table_name).schema}
+    return spark.sql(f"DESCRIBE DETAIL {table_name}").first().partitionColumns == ["sales_month"] \
+      and {(f.name, f.dataType.simpleString()) for f in df.schema} <= table_columns
+
+
+def create_silver_sales(valid):
+    valid.createOrReplaceTempView("v_silver_sales_checked")
+    spark.sql(f"""
+    create or replace table silver_sales
+    partitioned by (sales_month)
+    {silver_tblproperties("silver_sales")}
+    as
+    select * from v_silver_sales_checked
+    """)
+
+
+# rows breaking silver_sales_expectations are moved to silver_sales_quarantine, see Utils/Expectations
+def build_silver_sales():
+    sales = with_surrogate_keys(spark.table("v_silver_sales"), silver_sales_keys)
+    apply_expectations(sales, silver_sales_expectations, create_silver_sales, quarantine_table="silver_sales_quarantine")
+
+
+# update Silver table with change values and keep single row for each sale transaction by using MERGE
+def merge_silver_sales(valid):
+    if not has_silver_layout("silver_sales", valid):
+        create_silver_sales(valid)
+        return
+
+    valid.createOrReplaceTempView("v_silver_sales_checked")
+    spark.sql("""
+    merge into silver_sales target
+       using v_silver_sales_checked source
+       on target.id = source.id
+    when matched and target.row_hash <> source.row_hash then
+      update set *
+    when not matched then
+      insert *
+    """)
+
+
+def update_silver_sales():
+    sales = with_surrogate_keys(spark.table("v_silver_sales"), silver_sales_keys)
+    apply_expectations(sales, silver_sales_expectations, merge_silver_sales, quarantine_table="silver_sales_quarantine")
+
+# COMMAND ----------
+
+# Change Data Feed lets gold tables pick up only the changed items, so the table is kept up to date with MERGE after the first load
+def build_silver_sale_items():
+    def write(valid):
+        valid.createOrReplaceTempView("v_silver_sale_items_checked")
+        if not has_silver_layout("silver_sale_items", valid):
+            spark.sql(f"""
+            create or replace table silver_sale_items
+            partitioned by (sales_month)
+            {silver_tblproperties("silver_sale_items")}
+            as
+            select * from v_silver_sale_items_checked
+            """)
+            return
+
+        spark.sql("""
+        merge into silver_sale_items target
+           using v_silver_sale_items_checked source
+           on target.id = source.id
+        when matched and target.row_hash <> source.row_hash then
+          update set *
+        when not matched then
+          insert *
+        when not matched by source then
+          delete
+        """)
+
+    sale_items = with_surrogate_keys(spark.table("v_silver_sale_items"), silver_sale_items_keys)
+    apply_expectations(sale_items, silver_sale_items_expectations, write, quarantine_table="silver_sale_items_quarantine")
+
+# COMMAND ----------
+
+gold_country_sales_sql = """
+  select l.country_code, s.sales_month, sum(product_cost) as total_sales, count(distinct s.sale_key) as number_of_sales
+  from silver_sale_items s
+    join dim_locations l on s.store_id = l.id
+  group by l.country_code, s.sales_month
+"""
+
+
+# small enough to be aggregated on the driver (see Utils/Local-Engine), the plan is recorded for the Spark path (see Utils/Query-Profiles)
+def build_gold_country_sales():
+    profile_query(
+        "gold_country_sales",
+        lambda: write_query("gold_country_sales", gold_country_sales_sql, ["silver_sale_items", "dim_locations"]),
+        plan_sql=gold_country_sales_sql,
+        engine_result=True,
+    )
+
+# COMMAND ----------
+
+def daily_stages():
+    return [
+        *[{"name": d["name"], "run": lambda d=d: load_dimension(d), "provision": False, "inputs": d.get("lookup_tables", []), "paths": [d["source"]], "outputs": [d["name"]]} for d in dimensions],
+        # the stream checkpoint knows which landing files are new, including files in nested directories
+        {"name": "bronze_sales", "run": ingest_bronze_sales, "provision": False, "paths": [autoloader_ingest_path], "outputs": ["bronze_sales"]},
+        {"name": "silver_sales", "run": update_silver_sales, "inputs": ["bronze_sales"], "outputs": ["silver_sales"]},
+        {"name": "silver_sale_items", "run": build_silver_sale_items, "inputs": ["bronze_sales"], "outputs": ["silver_sale_items"]},
+        {"name": "silver_sale_item_ingredients", "run": build_ingredient_index, "inputs": ["silver_sale_items"], "outputs": ["dim_ingredients", "silver_sale_item_ingredients", "silver_ingredient_bitmaps"]},
+        {"name": "gold_country_sales", "run": build_gold_country_sales, "inputs": ["silver_sale_items", "dim_locations"], "outputs": ["gold_country_sales"]},
+        {"name": "gold_store_leaderboard", "run": update_top_customers, "inputs": ["silver_sale_items", "silver_sales", "dim_customers"], "outputs": ["gold_top_customers", "gold_store_leaderboard"]},
+        # snapshots live on the driver's local disk, so refresh_lookup_snapshots checks them itself on every run
+        {"name": "dimension_lookups", "run": refresh_lookup_snapshots, "provision": False, "inputs": ["dim_customers", "dim_locations"]},
+    ]
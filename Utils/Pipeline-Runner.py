@@ -0,0 +1,137 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Pipeline Runner
+# MAGIC 
+# MAGIC Runs pipeline stages as a dependency graph instead of in notebook cell order. Each stage is a dict with:
+# MAGIC * `name` - stage name, use the main output table so the stage shares its provisioning state with the notebook cells
+# MAGIC * `run` - function building the stage
+# MAGIC * `inputs` - tables the stage reads, a stage producing one of them must finish first
+# MAGIC * `paths` - optional input files, a change in them also triggers a rebuild
+# MAGIC * `outputs` - tables the stage writes
+# MAGIC * `provision` - optional, `False` for stages that track their inputs themselves (e.g. a stream checkpoint or a `provision` call in `run`) - they always run, and returning `False` from `run` marks them skipped
+# MAGIC 
+# MAGIC `run_pipeline` submits every stage whose upstream stages are done to a thread pool on the shared Spark session, so independent stages run concurrently. Stages with unchanged inputs are skipped (see `Utils/Provisioning`), stages that run get shuffle settings and an output file size for their input size (see `Utils/Stage-Tuning`) and their outputs get the Parquet settings of their layer - row groups and statistics as table properties, the codec on the session while the stage writes (see `Utils/Storage-Profiles`). Stage results and the chosen settings are kept in `pipeline_stage_runs` in the aux database - with `resume=True` the stages that succeeded in the last run are skipped, so a failed run continues from the failed stage.
+
+# COMMAND ----------
+
+# MAGIC %run ./Stage-Tuning
+
+# COMMAND ----------
+
+# MAGIC %run ./Storage-Profiles
+
+# COMMAND ----------
+
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pyspark.sql.functions as F
+
+pipeline_runs_table = f"{database_name}_aux.pipeline_stage_runs"
+stage_setting_columns = ["input_bytes", "shuffle_partitions", "advisory_partition_bytes", "target_file_size", "codec"]
+
+
+def _stage_dependencies(stages):
+    producers = {output: stage["name"] for stage in stages for output in stage.get("outputs", [])}
+    dependencies = {}
+    for stage in stages:
+        dependencies[stage["name"]] = {producers[t] for t in stage.get("inputs", []) if t in producers and producers[t] != stage["name"]}
+    return dependencies
+
+
+def _resumable_run():
+    # the last run, if it did not finish all its stages
+    if not spark.catalog.tableExists(pipeline_runs_table):
+        return None, set()
+    last = spark.table(pipeline_runs_table).orderBy(F.desc("finished_at")).select("run_id").first()
+    if last is None:
+        return None, set()
+
+    stages = spark.table(pipeline_runs_table).where(F.col("run_id") == last.run_id).select("stage", "status").collect()
+    if not any(r.status in ("failed", "upstream_failed") for r in stages):
+        return None, set()
+    return last.run_id, {r.stage for r in stages if r.status in ("succeeded", "skipped", "resumed")}
+
+
+def _run_stage(stage):
+    settings = {}
+
+    def build():
+        # only estimated for stages that run, skipped stages do not read their inputs
+        settings.update(stage_settings(stage_input_bytes(stage.get("inputs", []), stage.get("paths", [])), stage.get("outputs", [])))
+        # existing outputs get the profile before the stage writes, tables it creates afterwards
+        for table_name in stage.get("outputs", []):
+            apply_storage_profile(table_name)
+        with tuned_stage(stage["name"], settings, outputs=stage.get("outputs", [])):
+            rebuilt = stage["run"]()
+        for table_name in stage.get("outputs", []):
+            apply_storage_profile(table_name)
+        return rebuilt
+
+    start = time.time()
+    if stage.get("provision", True):
+        rebuilt = provision(stage["name"], build, paths=stage.get("paths", []), tables=stage.get("inputs", []))
+    else:
+        rebuilt = build() is not False
+    return "succeeded" if rebuilt else "skipped", time.time() - start, settings
+
+# COMMAND ----------
+
+def run_pipeline(stages, max_workers=4, resume=False):
+    dependencies = _stage_dependencies(stages)
+    stages_by_name = {stage["name"]: stage for stage in stages}
+
+    run_id, done = _resumable_run() if resume else (None, set())
+    run_id = run_id or uuid.uuid4().hex
+    results = {name: ("resumed", 0.0, None, {}) for name in done if name in stages_by_name}
+
+    pending = {name for name in stages_by_name if name not in results}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            progressed = False
+            for name in sorted(pending):
+                failed = {n for n, (status, _, _, _) in results.items() if status in ("failed", "upstream_failed")}
+                if dependencies[name] & failed:
+                    pending.discard(name)
+                    results[name] = ("upstream_failed", 0.0, None, {})
+                    progressed = True
+                elif dependencies[name] <= set(results):
+                    pending.discard(name)
+                    running[executor.submit(_run_stage, stages_by_name[name])] = name
+                    progressed = True
+
+            if not running:
+                if pending and not progressed:
+                    raise ValueError(f"Stages {sorted(pending)} depend on each other")
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    status, seconds, settings = future.result()
+                    results[name] = (status, seconds, None, settings)
+                except Exception as e:
+                    results[name] = ("failed", 0.0, str(e), {})
+                print(f"{name}: {results[name][0]} ({results[name][1]:.1f}s)")
+
+    spark.createDataFrame(
+        [
+            (run_id, name, status, seconds, error, *[settings.get(key) for key in stage_setting_columns])
+            for name, (status, seconds, error, settings) in results.items()
+        ],
+        "run_id string, stage string, status string, seconds double, error string, "
+        "input_bytes long, shuffle_partitions int, advisory_partition_bytes long, target_file_size long, codec string"
+    ) \
+      .withColumn("finished_at", F.current_timestamp()) \
+      .write \
+      .mode("append") \
+      .option("mergeSchema", "true") \
+      .saveAsTable(pipeline_runs_table)
+
+    failed = sorted(name for name, (status, _, _, _) in results.items() if status in ("failed", "upstream_failed"))
+    if failed:
+        raise RuntimeError(f"Pipeline run {run_id} failed in stages {failed} - run again with resume=True to continue")
+    return results
@@ -0,0 +1,116 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Incremental Provisioning
+# MAGIC 
+# MAGIC Keeps a fingerprint of the inputs (source files and upstream table versions) that each object was built from, together with the version of the object itself, in `<database>_aux.provisioning_state`.
+# MAGIC 
+# MAGIC With `provisioning_mode` set to `incremental`, `provision` only rebuilds an object when its inputs changed, the object was modified outside of the pipeline or one of its outputs is missing. With `full` every object is rebuilt.
+
+# COMMAND ----------
+
+#will be overwritten if provisioning_mode is passed as an argument
+dbutils.widgets.text("provisioning_mode", "full")
+provisioning_mode = dbutils.widgets.get("provisioning_mode")
+
+# COMMAND ----------
+
+import hashlib
+import threading
+import pyspark.sql.functions as F
+from pyspark.sql.utils import AnalysisException
+
+provisioning_state_table = f"{database_name}_aux.provisioning_state"
+
+# objects can be provisioned from several threads - serialize writes to the state table to avoid conflicting commits
+_provisioning_state_lock = threading.Lock()
+
+spark.sql(f"CREATE DATABASE IF NOT EXISTS {database_name}_aux")
+spark.sql(f"""
+CREATE TABLE IF NOT EXISTS {provisioning_state_table} (
+  object_name string,
+  fingerprint string,
+  table_version bigint,
+  updated_at timestamp
+)
+""")
+
+# COMMAND ----------
+
+def _path_exists(path):
+    try:
+        dbutils.fs.ls(path)
+        return True
+    except Exception:
+        return False
+
+
+def _path_entries(path):
+    if not _path_exists(path):
+        return [f"{path}:missing"]
+    return [f"{f.path}:{f.size}:{f.modificationTime}" for f in dbutils.fs.ls(path)]
+
+
+def table_version(table_name):
+    try:
+        return spark.sql(f"DESCRIBE HISTORY {table_name} LIMIT 1").first()["version"]
+    except AnalysisException:
+        return None
+
+
+def input_fingerprint(paths=(), tables=()):
+    entries = []
+    for path in paths:
+        entries += _path_entries(path)
+    for table_name in tables:
+        entries.append(f"{table_name}@{table_version(table_name)}")
+    return hashlib.sha256("|".join(sorted(entries)).encode()).hexdigest()
+
+# COMMAND ----------
+
+def _provisioning_state(object_name):
+    return spark.table(provisioning_state_table) \
+      .where(F.col("object_name") == object_name) \
+      .first()
+
+
+def record_provisioning(object_name, fingerprint):
+    update_df = spark.createDataFrame(
+        [(object_name, fingerprint, table_version(object_name))],
+        "object_name string, fingerprint string, table_version bigint"
+    )
+
+    with _provisioning_state_lock:
+        update_df.createOrReplaceTempView("provisioning_update")
+        spark.sql(f"""
+        MERGE INTO {provisioning_state_table} target
+        USING provisioning_update source
+        ON target.object_name = source.object_name
+        WHEN MATCHED THEN UPDATE SET
+          fingerprint = source.fingerprint, table_version = source.table_version, updated_at = current_timestamp()
+        WHEN NOT MATCHED THEN INSERT
+          (object_name, fingerprint, table_version, updated_at)
+          VALUES (source.object_name, source.fingerprint, source.table_version, current_timestamp())
+        """)
+
+
+def is_up_to_date(object_name, fingerprint, outputs=()):
+    if provisioning_mode != "incremental":
+        return False
+    state = _provisioning_state(object_name)
+    return state is not None \
+      and state.fingerprint == fingerprint \
+      and state.table_version == table_version(object_name) \
+      and all(_path_exists(path) for path in outputs)
+
+
+def provision(object_name, build, paths=(), tables=(), outputs=()):
+    # fingerprint is taken before the build, so inputs changing while it runs trigger a rebuild next time
+    fingerprint = input_fingerprint(paths, tables)
+    if is_up_to_date(object_name, fingerprint, outputs):
+        print(f"{object_name} is up to date - skipping")
+        return False
+
+    build()
+    record_provisioning(object_name, fingerprint)
+    return True
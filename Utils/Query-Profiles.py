@@ -0,0 +1,161 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Query Profiles
+# MAGIC 
+# MAGIC Records the plan and runtime metrics of important queries on every run, so a changed join strategy or a lost broadcast shows up before the runtime doubles:
+# MAGIC * `profile_query(name, run, plan_sql)` - runs `run()` in its own Spark job group and records the `EXPLAIN FORMATTED` plan of `plan_sql`. With `engine_result=True` `run()` returns the engine that ran the query (e.g. `write_query` of `Utils/Local-Engine`) and the Spark plan is only recorded when Spark ran it
+# MAGIC * `profiled_sql(name, statement)` - the same for a single SQL statement (e.g. a CTAS)
+# MAGIC 
+# MAGIC Executed plan metrics (join operators chosen at runtime by AQE, shuffle read / write, spill, task skew) are read from the Spark UI REST API of the driver. Without a Spark context (Spark Connect, shared access mode clusters) only the plan and timing are recorded. Profiles are appended to `query_profiles` in the aux database and compared with the previous run of the same query on the same engine - plan changes, join changes and runtimes above `profile_slowdown_threshold` times the previous one are printed as regressions.
+
+# COMMAND ----------
+
+import hashlib
+import json
+import re
+import time
+import urllib.request
+import uuid
+
+import pyspark.sql.functions as F
+
+query_profiles_table = f"{database_name}_aux.query_profiles"
+profile_slowdown_threshold = 1.5
+
+query_profile_schema = "query_name string, engine string, seconds double, plan string, plan_hash string, join_types array<string>, num_exchanges int, " \
+  "executed_join_types array<string>, shuffle_read_bytes long, shuffle_write_bytes long, spill_bytes long, max_task_skew double, regressions array<string>"
+
+join_operators = ["BroadcastHashJoin", "SortMergeJoin", "ShuffledHashJoin", "BroadcastNestedLoopJoin", "CartesianProduct"]
+# local properties set by setJobGroup, restored after the profiled run
+job_group_properties = ["spark.jobGroup.id", "spark.job.description", "spark.job.interruptOnCancel"]
+
+
+def _plan_summary(plan):
+    # expression ids (#123) and plan ids change between runs without the plan changing
+    normalized = re.sub(r"#\d+L?|plan_id=\d+|\[id=#?\d+\]", "", plan)
+    return {
+        "plan_hash": hashlib.sha256(normalized.encode()).hexdigest(),
+        "join_types": sorted(set(re.findall("|".join(join_operators), plan))),
+        "num_exchanges": len(re.findall(r"\bExchange\b", plan)),
+    }
+
+# COMMAND ----------
+
+def _spark_context():
+    # not available on Spark Connect, and shared access mode clusters reject its local property calls
+    try:
+        sc = spark.sparkContext
+        sc.getLocalProperty("spark.jobGroup.id")
+        return sc
+    except Exception:
+        return None
+
+
+def _spark_ui(path):
+    url = f"{spark.sparkContext.uiWebUrl}/api/v1/applications/{spark.sparkContext.applicationId}/{path}"
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def _no_executed_metrics():
+    return {"executed_join_types": [], "shuffle_read_bytes": 0, "shuffle_write_bytes": 0, "spill_bytes": 0, "max_task_skew": None}
+
+
+def _executed_metrics(job_ids):
+    metrics = _no_executed_metrics()
+    try:
+        stage_ids = {stage_id for job_id in job_ids for stage_id in _spark_ui(f"jobs/{job_id}")["stageIds"]}
+        for stage_id in stage_ids:
+            for attempt in _spark_ui(f"stages/{stage_id}"):
+                metrics["shuffle_read_bytes"] += attempt.get("shuffleReadBytes", 0)
+                metrics["shuffle_write_bytes"] += attempt.get("shuffleWriteBytes", 0)
+                metrics["spill_bytes"] += attempt.get("memoryBytesSpilled", 0) + attempt.get("diskBytesSpilled", 0)
+                if attempt.get("status") != "COMPLETE" or attempt.get("numCompleteTasks", 0) < 2:
+                    continue
+                # slowest task compared with the median task of the stage
+                run_time = _spark_ui(f"stages/{stage_id}/{attempt['attemptId']}/taskSummary?quantiles=0.5,1.0")["executorRunTime"]
+                if run_time[0] > 0:
+                    metrics["max_task_skew"] = max(metrics["max_task_skew"] or 0, run_time[1] / run_time[0])
+
+        executed_joins = set()
+        for execution in _spark_ui("sql?details=true&planDescription=false"):
+            execution_jobs = set(execution.get("successJobIds", []) + execution.get("failedJobIds", []) + execution.get("runningJobIds", []))
+            if execution_jobs & set(job_ids):
+                executed_joins |= {node["nodeName"] for node in execution.get("nodes", []) if node["nodeName"] in join_operators}
+        metrics["executed_join_types"] = sorted(executed_joins)
+    except Exception as e:
+        # the REST API is not reachable everywhere - keep the plan and timing only
+        print(f"Executed plan metrics not available: {e}")
+    return metrics
+
+
+def _previous_profile(name, engine):
+    if not spark.catalog.tableExists(query_profiles_table):
+        return None
+    return spark.table(query_profiles_table) \
+      .where((F.col("query_name") == name) & (F.col("engine") == engine)) \
+      .orderBy(F.desc("profiled_at")) \
+      .first()
+
+# COMMAND ----------
+
+def _regressions(profile, previous):
+    if previous is None:
+        return []
+    regressions = []
+    if profile["plan_hash"] and previous.plan_hash and profile["plan_hash"] != previous.plan_hash:
+        regressions.append("plan changed")
+    for key in ["join_types", "executed_join_types"]:
+        if previous[key] is not None and profile[key] and sorted(previous[key]) != profile[key]:
+            regressions.append(f"{key} {sorted(previous[key])} -> {profile[key]}")
+    if previous.seconds and profile["seconds"] > previous.seconds * profile_slowdown_threshold:
+        regressions.append(f"runtime {previous.seconds:.1f}s -> {profile['seconds']:.1f}s")
+    return regressions
+
+
+def profile_query(name, run, plan_sql=None, engine_result=False):
+    sc = _spark_context()
+    job_group = f"profile_{name}_{uuid.uuid4().hex[:8]}"
+    previous_properties = {}
+    if sc is not None:
+        previous_properties = {key: sc.getLocalProperty(key) for key in job_group_properties}
+        sc.setJobGroup(job_group, f"profile {name}")
+
+    start = time.time()
+    try:
+        result = run()
+    finally:
+        seconds = time.time() - start
+        if sc is not None:
+            for key, value in previous_properties.items():
+                sc.setLocalProperty(key, value)
+
+    # e.g. a query DuckDB ran on the driver has no Spark plan or shuffles to record
+    engine = result if engine_result else "spark"
+    plan = spark.sql(f"EXPLAIN FORMATTED {plan_sql}").first()[0] if plan_sql and engine == "spark" else ""
+
+    profile = {
+        "query_name": name,
+        "engine": engine,
+        "seconds": seconds,
+        "plan": plan,
+        **(_plan_summary(plan) if plan else {"plan_hash": None, "join_types": [], "num_exchanges": None}),
+        **(_executed_metrics(sc.statusTracker().getJobIdsForGroup(job_group)) if sc is not None and engine == "spark" else _no_executed_metrics()),
+    }
+    profile["regressions"] = _regressions(profile, _previous_profile(name, engine))
+
+    spark.createDataFrame([profile], query_profile_schema) \
+      .withColumn("profiled_at", F.current_timestamp()) \
+      .write \
+      .mode("append") \
+      .option("mergeSchema", "true") \
+      .saveAsTable(query_profiles_table)
+
+    for regression in profile["regressions"]:
+        print(f"{name}: {regression}")
+    return result
+
+
+def profiled_sql(name, statement):
+    return profile_query(name, lambda: spark.sql(statement), plan_sql=statement)
@@ -7,16 +7,22 @@
 dbutils.widgets.text("uc_status", "Enabled")
 uc_status= dbutils.widgets.get("uc_status")
 
+#full drops and recreates everything, incremental only rebuilds objects whose inputs changed
+dbutils.widgets.text("provisioning_mode", "full")
+provisioning_mode = dbutils.widgets.get("provisioning_mode")
+
 # COMMAND ----------
 
 if uc_status =='Enabled':
-  spark.sql(f"DROP CATALOG IF EXISTS {catalog_name} CASCADE;")
+  if provisioning_mode == 'full':
+    spark.sql(f"DROP CATALOG IF EXISTS {catalog_name} CASCADE;")
   spark.sql(f"CREATE CATALOG IF NOT EXISTS {catalog_name};")
   spark.sql(f"USE CATALOG {catalog_name};")
 
 # COMMAND ----------
 
-spark.sql(f"DROP DATABASE IF EXISTS {database_name} CASCADE")
+if provisioning_mode == 'full':
+  spark.sql(f"DROP DATABASE IF EXISTS {database_name} CASCADE")
 
 # COMMAND ----------
 
@@ -28,27 +34,29 @@ spark.sql(f"USE {database_name}")
 
 # COMMAND ----------
 
+# the user folder holds checkpoints, schemas and the landing zone - create it whatever the mode, a new workspace may start with incremental
+dbutils.fs.mkdirs(base_table_path)
+
+# COMMAND ----------
+
+# MAGIC %run ./Dataset-Cache
+
+# COMMAND ----------
+
 # get datasets from git
 
-def get_datasets_from_git(datasets_data_path, full_refresh=False):
-  import os
-  import zipfile
+import os
 
-  dbutils.fs.mkdirs(datasets_data_path)
-  
-  working_dir = os.path.split(os.path.split(os.getcwd())[0])[0]
-  with zipfile.ZipFile(f"{working_dir}/Datasets/sales2021.zip","r") as zip_ref:
-      zip_ref.extractall(datasets_data_path)
-  with zipfile.ZipFile(f"{working_dir}/Datasets/sales2022.zip","r") as zip_ref:
-      zip_ref.extractall(datasets_data_path)
-  with zipfile.ZipFile(f"{working_dir}/Datasets/dimensions.zip","r") as zip_ref:
-      zip_ref.extractall(datasets_data_path)
+working_dir = os.path.split(os.path.split(os.getcwd())[0])[0]
+dataset_archives = [f"{working_dir}/Datasets/{archive}" for archive in ["sales2021.zip", "sales2022.zip", "dimensions.zip"]]
 
 # COMMAND ----------
 
 # get datasets
+# raw files are shared by all users and only extracted when the archives changed, see Dataset-Cache
+dataset_path = base_table_path
 try:
-  get_datasets_from_git(local_data_path)
+  dataset_path = ensure_shared_datasets(dataset_archives)
 except Exception as e:
   print(e)
   !pip install --upgrade google-api-python-client google-auth-httplib2 google-auth-oauthlib tqdm
@@ -151,6 +159,15 @@ except Exception as e:
 
 # Return to the caller, passing the variables needed for file paths and database
 
-response = local_data_path + " " + base_table_path + " " + database_name+ " " +catalog_name
+import json
+
+response = {
+  "local_data_path": local_data_path,
+  "dbfs_data_path": base_table_path,
+  "dataset_path": dataset_path,
+  "database_name": database_name,
+  "catalog_name": catalog_name,
+  "username": username,
+}
 
-dbutils.notebook.exit(response)
+dbutils.notebook.exit(json.dumps(response))
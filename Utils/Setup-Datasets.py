@@ -11,27 +11,22 @@ spark.sql(f"USE {database_name}")
 
 # COMMAND ----------
 
-def get_datasets_from_git(datasets_data_path, full_refresh=False):
-  import os
-  import zipfile
+# MAGIC %run ./Dataset-Cache
 
-  dbutils.fs.mkdirs(datasets_data_path)
-  
-  working_dir = os.path.split(os.path.split(os.getcwd())[0])[0]
-  with zipfile.ZipFile(f"{working_dir}/Datasets/sales2021.zip","r") as zip_ref:
-      zip_ref.extractall(datasets_data_path)
-  with zipfile.ZipFile(f"{working_dir}/Datasets/sales2022.zip","r") as zip_ref:
-      zip_ref.extractall(datasets_data_path)
-  with zipfile.ZipFile(f"{working_dir}/Datasets/dimensions.zip","r") as zip_ref:
-      zip_ref.extractall(datasets_data_path)
-      
+# COMMAND ----------
 
+import os
+
+working_dir = os.path.split(os.path.split(os.getcwd())[0])[0]
+dataset_archives = [f"{working_dir}/Datasets/{archive}" for archive in ["sales2021.zip", "sales2022.zip", "dimensions.zip"]]
 
 # COMMAND ----------
 
 # get datasets
+# raw files are shared by all users and only extracted when the archives changed, see Dataset-Cache
+dataset_path = base_table_path
 try:
-  get_datasets_from_git(local_data_path)
+  dataset_path = ensure_shared_datasets(dataset_archives)
 except Exception as e:
   print(e)
   !pip install --upgrade google-api-python-client google-auth-httplib2 google-auth-oauthlib tqdm
@@ -134,9 +129,18 @@ except Exception as e:
 
 # Return to the caller, passing the variables needed for file paths and database
 
-response = local_data_path + " " + base_table_path + " " + database_name
+import json
+
+response = {
+  "local_data_path": local_data_path,
+  "dbfs_data_path": base_table_path,
+  "dataset_path": dataset_path,
+  "database_name": database_name,
+  "catalog_name": None,
+  "username": username,
+}
 
-dbutils.notebook.exit(response)
+dbutils.notebook.exit(json.dumps(response))
 
 # COMMAND ----------
 
@@ -0,0 +1,154 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Stage Tuning
+# MAGIC 
+# MAGIC Sizes shuffles and output files per pipeline stage instead of running every stage with the session defaults:
+# MAGIC * `stage_input_bytes` - input size of a stage from the Delta log of its input tables (see `Utils/Delta-Log`) and the size of all files under its input paths
+# MAGIC * `stage_settings` - shuffle partitions, AQE advisory partition size and target output file size for the input size from `stage_size_tiers`, and the Parquet codec of the outputs' layer (see `Utils/Storage-Profiles`)
+# MAGIC * `tuned_stage` - sets the shuffle settings and codec on the session while the stage runs and the target file size on the stage outputs as `delta.targetFileSize` before the stage writes, which optimized writes, auto compaction and `OPTIMIZE` use
+# MAGIC * `tblproperties_clause` - the `TBLPROPERTIES` of a `CREATE OR REPLACE` of a table, which would otherwise drop the file size and storage profile set before the write
+# MAGIC 
+# MAGIC Concurrent stages share one Spark session, so stages only run at the same time while they need the same session settings - a stage of another size tier or layer codec waits until the running stages are done. `Utils/Pipeline-Runner` records the chosen settings next to the stage runtime in `pipeline_stage_runs`.
+
+# COMMAND ----------
+
+# MAGIC %run ./Storage-Profiles
+
+# COMMAND ----------
+
+import threading
+from contextlib import contextmanager
+
+# (largest input size, shuffle partitions, AQE advisory partition size, target output file size) - the last tier has no limit
+# AQE coalesces the partitions of smaller shuffles within a tier down to the advisory size
+stage_size_tiers = [
+    (64 * 1024 * 1024, 8, 16 * 1024 * 1024, 16 * 1024 * 1024),
+    (1024 * 1024 * 1024, 64, 64 * 1024 * 1024, 64 * 1024 * 1024),
+    (None, 400, 128 * 1024 * 1024, 256 * 1024 * 1024),
+]
+
+stage_confs = {
+    "shuffle_partitions": "spark.sql.shuffle.partitions",
+    "advisory_partition_bytes": "spark.sql.adaptive.advisoryPartitionSizeInBytes",
+    "codec": storage_codec_conf,
+}
+# codec of stages without outputs in a profiled layer, Spark's default
+default_stage_codec = "snappy"
+
+# session confs of the stages running now by stage name, and the values they replaced
+_running_stage_confs = globals().get("_running_stage_confs", {})
+_session_defaults = globals().get("_session_defaults", {})
+_stage_confs_changed = globals().get("_stage_confs_changed", threading.Condition())
+# settings and outputs of the stage the current thread runs, see tblproperties_clause
+_current_stage = globals().get("_current_stage", threading.local())
+
+
+def _table_bytes(table_name):
+    if not spark.catalog.tableExists(table_name):
+        return 0
+    try:
+        return delta_table_stats(delta_snapshot(delta_table_path(table_name)))["size_bytes"]
+    except Exception:
+        # the log is not readable through /dbfs (e.g. external cloud storage) - ask Delta instead
+        return spark.sql(f"DESCRIBE DETAIL {table_name}").first()["sizeInBytes"] or 0
+
+
+def _path_bytes(path):
+    # landing zones keep their files in nested directories
+    try:
+        entries = dbutils.fs.ls(path)
+    except Exception:
+        return 0
+    return sum(_path_bytes(f.path) if f.isDir() else f.size for f in entries)
+
+
+def stage_input_bytes(tables=(), paths=()):
+    return sum(_table_bytes(t) for t in tables) + sum(_path_bytes(p) for p in paths)
+
+# COMMAND ----------
+
+def stage_settings(input_bytes, outputs=()):
+    for max_bytes, shuffle_partitions, advisory_partition_bytes, target_file_size in stage_size_tiers:
+        if max_bytes is None or input_bytes <= max_bytes:
+            break
+    # a stage writing several layers uses the codec of its first output
+    codecs = [codec for codec in map(storage_codec, outputs) if codec]
+    return {
+        "input_bytes": input_bytes,
+        "shuffle_partitions": shuffle_partitions,
+        "advisory_partition_bytes": advisory_partition_bytes,
+        "target_file_size": target_file_size,
+        "codec": codecs[0] if codecs else default_stage_codec,
+    }
+
+
+def _target_file_size_property(target_file_size):
+    return f"{target_file_size // (1024 * 1024)}mb"
+
+
+def set_target_file_size(table_name, target_file_size):
+    target = _target_file_size_property(target_file_size)
+    if spark.catalog.tableExists(table_name) \
+      and spark.sql(f"DESCRIBE DETAIL {table_name}").first().properties.get("delta.targetFileSize") != target:
+        spark.sql(f"ALTER TABLE {table_name} SET TBLPROPERTIES (delta.targetFileSize = '{target}')")
+
+
+def replaced_table_properties(table_name):
+    layer = table_layer(table_name)
+    properties = _profile_properties(table_name, layer) if layer in storage_profiles else {}
+
+    # inside a stage its outputs get the stage's file size, elsewhere a replaced table keeps its current one
+    settings = getattr(_current_stage, "settings", None)
+    if settings is not None and table_name in _current_stage.outputs:
+        properties["delta.targetFileSize"] = _target_file_size_property(settings["target_file_size"])
+    elif spark.catalog.tableExists(table_name):
+        target = spark.sql(f"DESCRIBE DETAIL {table_name}").first().properties.get("delta.targetFileSize")
+        if target:
+            properties["delta.targetFileSize"] = target
+    return properties
+
+
+def tblproperties_clause(table_name, properties=None):
+    properties = {**(properties or {}), **replaced_table_properties(table_name)}
+    return f"tblproperties ({_properties_sql(properties)})" if properties else ""
+
+# COMMAND ----------
+
+def _set_session_confs(confs):
+    for conf, value in confs.items():
+        if value is None:
+            spark.conf.unset(conf)
+        else:
+            spark.conf.set(conf, value)
+
+
+@contextmanager
+def tuned_stage(name, settings, outputs=()):
+    confs = {conf: str(settings[key]) for key, conf in stage_confs.items()}
+    with _stage_confs_changed:
+        # the session conf is shared - wait until the running stages need the same settings or are done
+        _stage_confs_changed.wait_for(lambda: all(running == confs for running in _running_stage_confs.values()))
+        if not _running_stage_confs:
+            _session_defaults.clear()
+            _session_defaults.update({conf: spark.conf.get(conf, None) for conf in confs})
+            _set_session_confs(confs)
+        _running_stage_confs[name] = confs
+
+    _current_stage.settings, _current_stage.outputs = settings, set(outputs)
+    try:
+        # existing outputs get the file size before the stage writes, replaced ones through tblproperties_clause
+        for table_name in outputs:
+            set_target_file_size(table_name, settings["target_file_size"])
+        yield settings
+
+        # outputs the stage created with a DataFrame write
+        for table_name in outputs:
+            set_target_file_size(table_name, settings["target_file_size"])
+    finally:
+        _current_stage.settings = None
+        with _stage_confs_changed:
+            del _running_stage_confs[name]
+            if not _running_stage_confs:
+                _set_session_confs(_session_defaults)
+            _stage_confs_changed.notify_all()
@@ -0,0 +1,143 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Storage Profiles
+# MAGIC 
+# MAGIC Parquet write settings per layer instead of the defaults for every table:
+# MAGIC * bronze is written often and rarely read in full - `zstd` for the smallest files
+# MAGIC * silver is scanned by joins - `snappy` for cheap decompression and large row groups
+# MAGIC * gold is read by dashboards - `snappy` with small row groups and pages, so selective reads skip more data
+# MAGIC 
+# MAGIC `apply_storage_profile` stores the profile of a table's layer as table properties - the row group and page size (`storage_profile_properties`), which Delta hands to the Parquet writer of every write to the table, and the columns that collect data skipping statistics (`storage_stats_columns`, otherwise the first `num_indexed_cols`). Tables replaced by `CREATE OR REPLACE` keep them through `tblproperties_clause` (see `Utils/Stage-Tuning`).
+# MAGIC 
+# MAGIC Spark picks the codec from `spark.sql.parquet.compression.codec` and ignores a `parquet.compression` table property, so the codec is set on the session while a pipeline stage writes (`storage_codec`, applied by `tuned_stage` in `Utils/Stage-Tuning`) or within `parquet_codec`. Writes outside of both use the session default.
+# MAGIC 
+# MAGIC Profile changes only apply to files written afterwards - existing files keep their codec, row groups and statistics until they are rewritten (e.g. by `OPTIMIZE`). `benchmark_storage_profiles` writes a table with every profile the way pipeline stages do and reports size, write and scan times to `storage_benchmarks` in the aux database.
+
+# COMMAND ----------
+
+# MAGIC %run ./Table-Maintenance
+
+# COMMAND ----------
+
+import time
+from contextlib import contextmanager
+
+storage_profiles = {
+    "bronze": {"codec": "zstd", "row_group_bytes": 128 * 1024 * 1024, "page_bytes": 1024 * 1024, "num_indexed_cols": 8},
+    "silver": {"codec": "snappy", "row_group_bytes": 128 * 1024 * 1024, "page_bytes": 1024 * 1024, "num_indexed_cols": 16},
+    "gold": {"codec": "snappy", "row_group_bytes": 16 * 1024 * 1024, "page_bytes": 256 * 1024, "num_indexed_cols": 32},
+}
+
+# columns used in joins and filters - nested and free text columns only cost stats collection time
+storage_stats_columns = {
+    "bronze_sales": ["SaleID", "Location", "exported_ts"],
+    "silver_sales": ["id", "sale_key", "customer_key", "store_id", "sale_date"],
+    "silver_sale_items": ["id", "sale_key", "store_id", "sale_date", "product_id"],
+}
+
+# Parquet writer settings Delta passes on from the table properties
+storage_profile_properties = {
+    "row_group_bytes": "parquet.block.size",
+    "page_bytes": "parquet.page.size",
+}
+storage_codec_conf = "spark.sql.parquet.compression.codec"
+
+storage_benchmark_table = f"{database_name}_aux.storage_benchmarks"
+
+# COMMAND ----------
+
+def storage_codec(table_name):
+    layer = table_layer(table_name)
+    return storage_profiles[layer]["codec"] if layer in storage_profiles else None
+
+
+@contextmanager
+def parquet_codec(codec):
+    # session wide - only for writes that do not run next to pipeline stages
+    default = spark.conf.get(storage_codec_conf, None)
+    spark.conf.set(storage_codec_conf, codec)
+    try:
+        yield
+    finally:
+        if default is None:
+            spark.conf.unset(storage_codec_conf)
+        else:
+            spark.conf.set(storage_codec_conf, default)
+
+
+def _profile_properties(table_name, layer):
+    properties = {option: str(storage_profiles[layer][key]) for key, option in storage_profile_properties.items()}
+    stats_columns = storage_stats_columns.get(table_name.split(".")[-1])
+    if stats_columns:
+        properties["delta.dataSkippingStatsColumns"] = ",".join(stats_columns)
+    else:
+        properties["delta.dataSkippingNumIndexedCols"] = str(storage_profiles[layer]["num_indexed_cols"])
+    return properties
+
+
+def _properties_sql(properties):
+    return ", ".join(f"'{key}' = {value!r}" for key, value in properties.items())
+
+
+def apply_storage_profile(table_name, layer=None):
+    layer = layer or table_layer(table_name)
+    if layer not in storage_profiles or not spark.catalog.tableExists(table_name):
+        return None
+
+    # only files written from now on use the new settings and statistics columns
+    properties = _profile_properties(table_name, layer)
+    current = spark.sql(f"DESCRIBE DETAIL {table_name}").first().properties
+    if any(current.get(key) != value for key, value in properties.items()):
+        spark.sql(f"ALTER TABLE {table_name} SET TBLPROPERTIES ({_properties_sql(properties)})")
+    return properties
+
+# COMMAND ----------
+
+def _timed(run):
+    start = time.time()
+    run()
+    return time.time() - start
+
+
+def benchmark_storage_profiles(table_name, filter_expr=None, layers=None):
+    # the disk cache would serve the scans from local SSD after the first profile
+    cache_enabled = spark.conf.get("spark.databricks.io.cache.enabled", "false")
+    spark.conf.set("spark.databricks.io.cache.enabled", "false")
+
+    results = []
+    try:
+        for layer in layers or storage_profiles:
+            copy_table = f"{database_name}_aux.storage_benchmark_{table_name.split('.')[-1]}_{layer}"
+            properties = _profile_properties(table_name, layer)
+
+            spark.sql(f"DROP TABLE IF EXISTS {copy_table}")
+            # the table properties and codec conf a pipeline stage writes the layer with
+            with parquet_codec(storage_profiles[layer]["codec"]):
+                write_seconds = _timed(lambda: spark.sql(f"create table {copy_table} tblproperties ({_properties_sql(properties)}) as select * from {table_name}"))
+
+            detail = spark.sql(f"DESCRIBE DETAIL {copy_table}").first()
+            scan = spark.table(copy_table)
+            results.append({
+                "table_name": table_name,
+                "layer": layer,
+                **storage_profiles[layer],
+                "size_bytes": detail.sizeInBytes,
+                "num_files": detail.numFiles,
+                "write_seconds": write_seconds,
+                "full_scan_seconds": _timed(lambda: scan.write.format("noop").mode("overwrite").save()),
+                "filtered_scan_seconds": _timed(lambda: scan.where(filter_expr).write.format("noop").mode("overwrite").save()) if filter_expr else None,
+            })
+            spark.sql(f"DROP TABLE {copy_table}")
+            print(f"{table_name} ({layer}): {detail.sizeInBytes / 1024 / 1024:.1f} MB, write {write_seconds:.1f}s, "
+                  f"full scan {results[-1]['full_scan_seconds']:.1f}s")
+    finally:
+        spark.conf.set("spark.databricks.io.cache.enabled", cache_enabled)
+
+    spark.createDataFrame(results, "table_name string, layer string, codec string, row_group_bytes long, page_bytes long, num_indexed_cols int, "
+                                   "size_bytes long, num_files long, write_seconds double, full_scan_seconds double, filtered_scan_seconds double") \
+      .withColumn("benchmarked_at", F.current_timestamp()) \
+      .write \
+      .mode("append") \
+      .saveAsTable(storage_benchmark_table)
+    return results
@@ -0,0 +1,64 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Surrogate Keys
+# MAGIC 
+# MAGIC Natural keys of sales data are long strings (`unique_customer_id`, UUID sale ids, `sale_id-pos` item ids), which makes shuffles and hash joins in gold expensive. `assign_keys` gives every natural key of an entity a stable `bigint` key and adds it as `<entity>_key` to a DataFrame.
+# MAGIC 
+# MAGIC Keys are kept in one `<entity>_keys` table per entity (`natural_key`, `<entity>_key` identity column). New natural keys are inserted with MERGE, existing ones keep their key, so keys stay valid across runs and can be used to join silver and gold tables. Null natural keys get a null key.
+
+# COMMAND ----------
+
+import threading
+
+import pyspark.sql.functions as F
+
+# stages running in parallel (see Utils/Pipeline-Runner) can assign keys of the same entity - serialize the MERGEs per key table
+_key_table_locks = globals().get("_key_table_locks", {})
+_key_table_locks_guard = threading.Lock()
+
+
+def key_table(entity):
+    return f"{entity}_keys"
+
+
+def create_key_table(entity):
+    spark.sql(f"""
+    create table if not exists {key_table(entity)} (
+      {entity}_key bigint generated always as identity,
+      natural_key string not null
+    )
+    """)
+    return key_table(entity)
+
+
+def assign_keys(df, entity, natural_key_column):
+    table = create_key_table(entity)
+
+    with _key_table_locks_guard:
+        lock = _key_table_locks.setdefault(entity, threading.Lock())
+
+    with lock:
+        df.select(F.col(natural_key_column).alias("natural_key")) \
+          .where(F.col("natural_key").isNotNull()) \
+          .distinct() \
+          .createOrReplaceTempView(f"{entity}_natural_keys")
+
+        spark.sql(f"""
+        merge into {table} target
+          using {entity}_natural_keys source
+          on target.natural_key = source.natural_key
+        when not matched then
+          insert (natural_key) values (source.natural_key)
+        """)
+
+    keys = spark.table(table).select(F.col("natural_key").alias(f"_{entity}_natural_key"), f"{entity}_key")
+    return df.join(keys, df[natural_key_column] == keys[f"_{entity}_natural_key"], "left") \
+      .drop(f"_{entity}_natural_key")
+
+
+def with_surrogate_keys(df, keys):
+    # keys maps entity to the column holding its natural key, e.g. {"sale": "id"}
+    for entity, natural_key_column in keys.items():
+        df = assign_keys(df, entity, natural_key_column)
+    return df
@@ -0,0 +1,81 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Table Changes
+# MAGIC 
+# MAGIC `changes(table_name, from_version, to_version)` returns the rows that changed after `from_version` up to and including `to_version`, so consumers can sync incrementally instead of re-reading a full snapshot.
+# MAGIC 
+# MAGIC * With Change Data Feed enabled on the table, the change feed is read (`insert`, `delete`, `update_preimage`, `update_postimage`). Tables with deletion vectors (e.g. `bronze_sales`) or on cloud storage (e.g. Unity Catalog) need it - enable it with `enable_change_data_feed`, changes are available from that version on.
+# MAGIC * Otherwise the rows of the data files added (`insert`) and removed (`delete`) between the two versions are read, using the file list from `Utils/Delta-Log`. Rewritten files (e.g. by `OPTIMIZE` or `UPDATE`) show all their rows as deleted and inserted again, so consumers should apply them as upserts. Removed files must not be vacuumed yet. This only works for tables whose log is readable on the driver (see `delta_log_readable`) and versions without deletion vectors.
+# MAGIC 
+# MAGIC Both return the table columns plus `_change_type`, `_commit_version` and `_commit_timestamp` of the commit that added or removed the rows.
+# MAGIC 
+# MAGIC Requires `table_version` from `Utils/Provisioning`.
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Log
+
+# COMMAND ----------
+
+import pyspark.sql.functions as F
+from urllib.parse import unquote
+
+
+def _cdf_enabled(detail):
+    return detail.properties.get("delta.enableChangeDataFeed") == "true"
+
+
+def enable_change_data_feed(table_name):
+    if not _cdf_enabled(spark.sql(f"DESCRIBE DETAIL {table_name}").first()):
+        spark.sql(f"ALTER TABLE {table_name} SET TBLPROPERTIES (delta.enableChangeDataFeed = true)")
+
+
+def _read_change_feed(table_name, from_version, to_version):
+    return spark.read \
+      .format("delta") \
+      .option("readChangeFeed", "true") \
+      .option("startingVersion", from_version + 1) \
+      .option("endingVersion", to_version) \
+      .table(table_name)
+
+
+def _read_data_files(table_path, schema, files, change_type, version, timestamp_ms):
+    paths = [f["path"] if "://" in f["path"] else f"{table_path.rstrip('/')}/{unquote(f['path'])}" for f in files]
+    return spark.read \
+      .schema(schema) \
+      .option("basePath", table_path) \
+      .parquet(*paths) \
+      .withColumn("_change_type", F.lit(change_type)) \
+      .withColumn("_commit_version", F.lit(version).cast("long")) \
+      .withColumn("_commit_timestamp", F.timestamp_millis(F.lit(timestamp_ms)))
+
+
+def changes(table_name, from_version, to_version=None):
+    detail = spark.sql(f"DESCRIBE DETAIL {table_name}").first()
+    if to_version is None:
+        to_version = table_version(table_name)
+
+    if _cdf_enabled(detail):
+        return _read_change_feed(table_name, from_version, to_version)
+
+    if not delta_log_readable(detail.location):
+        raise ValueError(f"The log of {table_name} is not readable on the driver ({detail.location}) - enable Change Data Feed to read its changes")
+    diff = delta_file_diff(detail.location, from_version, to_version)
+    if any("deletionVector" in f for f in diff["added"] + diff["removed"]):
+        raise ValueError(f"{table_name} has deletion vectors between versions {from_version} and {to_version} - enable Change Data Feed to read its changes")
+
+    schema = spark.table(table_name).schema
+    result = spark.createDataFrame([], schema) \
+      .withColumn("_change_type", F.lit(None).cast("string")) \
+      .withColumn("_commit_version", F.lit(None).cast("long")) \
+      .withColumn("_commit_timestamp", F.lit(None).cast("timestamp"))
+
+    # one read per commit and change type, so every row carries the version that changed it
+    groups = {}
+    for change_type, files in [("delete", diff["removed"]), ("insert", diff["added"])]:
+        for f in files:
+            groups.setdefault((diff["file_versions"][_file_key(f)], change_type), []).append(f)
+    for (version, change_type), files in sorted(groups.items()):
+        result = result.unionByName(_read_data_files(detail.location, schema, files, change_type, version, diff["commit_timestamps"].get(version)))
+    return result
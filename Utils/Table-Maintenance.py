@@ -0,0 +1,258 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Table Maintenance
+# MAGIC 
+# MAGIC Helpers to keep the number of small files under control:
+# MAGIC * `enable_optimized_writes` - turn on optimized writes and auto compaction for a Delta table, if not on yet
+# MAGIC * `compact_table` - bin-pack small files of a Delta table into files of its `delta.targetFileSize` (or `compaction_target_file_size_mb`), without changing the table properties
+# MAGIC * `roll_up_landing_files` - merge aged landing zone JSON files that the Autoloader stream has already ingested (`cloud_files_state` of its checkpoint) into larger archive files
+# MAGIC * `enable_deletion_vectors` / `purge_deletion_vectors` - let UPDATE, DELETE and MERGE mark changed rows in deletion vectors instead of rewriting whole files, and rewrite the files of a table once too many of their rows are deleted (always for tables whose log is not readable on the driver)
+# MAGIC * `apply_retention_policy` - set checkpoint interval and log / file retention of a table from `retention_policies` and `VACUUM` it, reporting how long opening the table from scratch takes before and after
+# MAGIC 
+# MAGIC `5 Table Maintenance` runs these as a separate periodic job next to the ingest pipeline.
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Log
+
+# COMMAND ----------
+
+import os
+import re
+import time
+from functools import reduce
+
+import pyspark.sql.functions as F
+
+compaction_target_file_size_mb = 128
+landing_small_file_size_mb = 16
+deletion_vector_purge_ratio = 0.05
+
+
+def enable_optimized_writes(table_name):
+    properties = spark.sql(f"DESCRIBE DETAIL {table_name}").first().properties
+    if properties.get("delta.autoOptimize.optimizeWrite") == "true" and properties.get("delta.autoOptimize.autoCompact") == "true":
+        return
+    spark.sql(f"""
+    ALTER TABLE {table_name} SET TBLPROPERTIES (
+      delta.autoOptimize.optimizeWrite = true,
+      delta.autoOptimize.autoCompact = true
+    )
+    """)
+
+
+def _size_bytes(value):
+    # table property sizes are written as e.g. '128mb' or plain bytes
+    match = re.fullmatch(r"\s*(\d+)\s*(b|kb|mb|gb)?\s*", value.lower())
+    return int(match.group(1)) * {None: 1, "b": 1, "kb": 1024, "mb": 1024 ** 2, "gb": 1024 ** 3}[match.group(2)]
+
+
+def compact_table(table_name, target_file_size_mb=None, min_files=50):
+    detail = spark.sql(f"DESCRIBE DETAIL {table_name}").first()
+
+    # delta.targetFileSize is owned by the pipeline (see Utils/Stage-Tuning) - only OPTIMIZE of tables without it is sized here
+    table_target_file_size = detail.properties.get("delta.targetFileSize")
+    if target_file_size_mb is None and table_target_file_size:
+        target_file_size = _size_bytes(table_target_file_size)
+    else:
+        target_file_size = (target_file_size_mb or compaction_target_file_size_mb) * 1024 * 1024
+
+    # only bin-pack when there are enough files well below the target size
+    average_file_size = detail.sizeInBytes / max(detail.numFiles, 1)
+    if detail.numFiles < min_files or average_file_size >= target_file_size / 2:
+        print(f"{table_name}: {detail.numFiles} files, average {average_file_size / 1024:.0f} KB - nothing to compact")
+        return None
+
+    max_file_size = spark.conf.get("spark.databricks.delta.optimize.maxFileSize", None)
+    spark.conf.set("spark.databricks.delta.optimize.maxFileSize", str(target_file_size))
+    try:
+        metrics = spark.sql(f"OPTIMIZE {table_name}").first()["metrics"]
+    finally:
+        if max_file_size is None:
+            spark.conf.unset("spark.databricks.delta.optimize.maxFileSize")
+        else:
+            spark.conf.set("spark.databricks.delta.optimize.maxFileSize", max_file_size)
+    print(f"{table_name}: compacted {metrics.numFilesRemoved} files into {metrics.numFilesAdded}")
+    return metrics
+
+# COMMAND ----------
+
+def enable_deletion_vectors(table_name):
+    # upgrades the table protocol - readers need Delta 2.3 / DBR 12.2 or newer
+    if spark.sql(f"DESCRIBE DETAIL {table_name}").first().properties.get("delta.enableDeletionVectors") != "true":
+        spark.sql(f"ALTER TABLE {table_name} SET TBLPROPERTIES (delta.enableDeletionVectors = true)")
+
+
+def purge_deletion_vectors(table_name, min_deleted_ratio=deletion_vector_purge_ratio):
+    table_path = delta_table_path(table_name)
+    if delta_log_readable(table_path):
+        # readers skip deleted rows at scan time, so only rewrite the files once the deleted rows are worth the rewrite
+        stats = delta_table_stats(delta_snapshot(table_path))
+        deleted, remaining = stats["num_deleted_records"], stats["num_records"]
+        if deleted == 0 or (remaining is not None and deleted / (deleted + remaining) < min_deleted_ratio):
+            print(f"{table_name}: {deleted} rows in deletion vectors - nothing to purge")
+            return None
+    else:
+        # the log of cloud storage locations (e.g. Unity Catalog) is not readable here - REORG only rewrites files with deletion vectors
+        deleted = "all"
+
+    metrics = spark.sql(f"REORG TABLE {table_name} APPLY (PURGE)").first()["metrics"]
+    print(f"{table_name}: purged {deleted} deleted rows, rewrote {metrics.numFilesRemoved} files into {metrics.numFilesAdded}")
+    return metrics
+
+# COMMAND ----------
+
+def _list_files(path):
+    for f in dbutils.fs.ls(path):
+        if f.isDir():
+            yield from _list_files(f.path)
+        else:
+            yield f
+
+
+def _normalized_path(path):
+    # listings and the Autoloader state do not always agree on repeated slashes
+    return re.sub(r"(?<!:)/{2,}", "/", path)
+
+
+def _processed_files(checkpoint_path):
+    # files the Autoloader stream with this checkpoint has already ingested
+    return {_normalized_path(r.path) for r in spark.sql(f"SELECT path FROM cloud_files_state('{checkpoint_path}')").collect()}
+
+
+def roll_up_landing_files(ingest_path, archive_path, checkpoint_path, min_age_days=7, small_file_size_mb=landing_small_file_size_mb, files_per_archive=1000):
+    # archive_path must be outside of ingest_path so Autoloader does not pick the archives up again
+    cutoff = (time.time() - min_age_days * 24 * 60 * 60) * 1000
+    processed = _processed_files(checkpoint_path)
+
+    files_by_dir = {}
+    for f in _list_files(ingest_path):
+        if f.name.endswith(".json"):
+            files_by_dir.setdefault(f.path.rsplit("/", 1)[0], []).append(f)
+
+    aged_files = []
+    for files in files_by_dir.values():
+        # files the stream has not ingested yet stay, however old they are
+        aged_files += [f for f in files if f.size < small_file_size_mb * 1024 * 1024 and f.modificationTime < cutoff and _normalized_path(f.path) in processed]
+
+    run_id = int(time.time())
+    for i in range(0, len(aged_files), files_per_archive):
+        batch = aged_files[i:i + files_per_archive]
+        spark.read.text([f.path for f in batch]) \
+          .coalesce(1) \
+          .write \
+          .mode("overwrite") \
+          .option("compression", "gzip") \
+          .text(f"{archive_path}rollup_{run_id}_{i // files_per_archive}")
+
+        for f in batch:
+            dbutils.fs.rm(f.path)
+
+    # remove the Spark output directories (e.g. daily_sales.json/) once all their part files are archived
+    archived_paths = {f.path for f in aged_files}
+    for dir_path, files in files_by_dir.items():
+        if dir_path.endswith(".json") and all(f.path in archived_paths for f in files):
+            dbutils.fs.rm(dir_path, True)
+
+    print(f"Rolled up {len(aged_files)} landing files from {ingest_path} into {archive_path}")
+    return len(aged_files)
+
+# COMMAND ----------
+
+# bronze gets a commit per micro-batch, so it is checkpointed twice as often as Delta's default (10) and keeps the least history.
+# silver and gold get a few MERGE / overwrite commits per run - checkpoints are written less often, as every checkpoint rewrites the whole file list.
+# silver keeps more history - Change Data Feed readers (e.g. Utils/Top-Customers) need the versions since their last run.
+retention_policies = {
+    "bronze": {"checkpoint_interval": 5, "log_retention_days": 7, "deleted_file_retention_days": 7},
+    "silver": {"checkpoint_interval": 20, "log_retention_days": 30, "deleted_file_retention_days": 30},
+    "gold": {"checkpoint_interval": 20, "log_retention_days": 7, "deleted_file_retention_days": 7},
+}
+
+retention_report_table = f"{database_name}_aux.table_retention_reports"
+retention_report_schema = "table_name string, layer string, open_seconds_before double, open_seconds_after double, cold_open boolean, " \
+  "num_files long, commits_since_checkpoint long, log_files long"
+
+
+def table_layer(table_name):
+    prefix = table_name.split(".")[-1].split("_")[0]
+    # dimensions are treated like silver tables
+    return "silver" if prefix == "dim" else prefix
+
+
+def _clear_delta_log_cache():
+    # Delta keeps opened snapshots cached - without clearing them an open only reads the newest commits
+    for delta_log in ["com.databricks.sql.transaction.tahoe.DeltaLog", "org.apache.spark.sql.delta.DeltaLog"]:
+        try:
+            reduce(getattr, delta_log.split("."), spark._jvm).clearCache()
+            return True
+        except Exception:
+            # not available on Spark Connect and shared access mode clusters
+            continue
+    return False
+
+
+def table_open_seconds(table_name, table_path):
+    # time to open the table from scratch, which is mostly replaying the log since the last checkpoint - and whether it was a cold open
+    if delta_log_readable(table_path):
+        start = time.perf_counter()
+        delta_snapshot(table_path)
+        return time.perf_counter() - start, True
+
+    cold = _clear_delta_log_cache()
+    start = time.perf_counter()
+    spark.sql(f"DESCRIBE DETAIL {table_name}").first()
+    return time.perf_counter() - start, cold
+
+
+def table_log_stats(table_path):
+    # the log layout is only visible for tables on DBFS - cloud storage locations (e.g. Unity Catalog) report None
+    if not delta_log_readable(table_path):
+        return {"commits_since_checkpoint": None, "log_files": None}
+    log_dir = _log_dir(table_path)
+    version = max(_commit_versions(log_dir), default=-1)
+    checkpoint_version = max(_checkpoints(log_dir), default=-1)
+    return {"commits_since_checkpoint": version - checkpoint_version, "log_files": len(os.listdir(log_dir))}
+
+# COMMAND ----------
+
+def apply_retention_policy(table_name, layer=None, vacuum=True):
+    layer = layer or table_layer(table_name)
+    policy = retention_policies[layer]
+    table_path = delta_table_path(table_name)
+
+    open_seconds_before, cold_before = table_open_seconds(table_name, table_path)
+
+    # old log files are removed automatically whenever a checkpoint is written
+    spark.sql(f"""
+    ALTER TABLE {table_name} SET TBLPROPERTIES (
+      delta.checkpointInterval = {policy["checkpoint_interval"]},
+      delta.logRetentionDuration = 'interval {policy["log_retention_days"]} days',
+      delta.deletedFileRetentionDuration = 'interval {policy["deleted_file_retention_days"]} days'
+    )
+    """)
+    if vacuum:
+        spark.sql(f"VACUUM {table_name} RETAIN {policy['deleted_file_retention_days'] * 24} HOURS")
+
+    # a changed interval shows from the next checkpoint on, so compare the reports of later runs as well
+    open_seconds_after, cold_after = table_open_seconds(table_name, table_path)
+    report = {
+        "table_name": table_name,
+        "layer": layer,
+        "open_seconds_before": open_seconds_before,
+        "open_seconds_after": open_seconds_after,
+        "cold_open": cold_before and cold_after,
+        "num_files": spark.sql(f"DESCRIBE DETAIL {table_name}").first().numFiles,
+        **table_log_stats(table_path),
+    }
+    print(f"{table_name} ({layer}): open {open_seconds_before * 1000:.0f} ms -> {open_seconds_after * 1000:.0f} ms"
+          f"{'' if report['cold_open'] else ' (cached snapshot)'}, {report['commits_since_checkpoint']} commits since last checkpoint, "
+          f"{report['log_files']} log files")
+
+    spark.createDataFrame([report], retention_report_schema) \
+      .withColumn("reported_at", F.current_timestamp()) \
+      .write \
+      .mode("append") \
+      .option("mergeSchema", "true") \
+      .saveAsTable(retention_report_table)
+    return report
@@ -0,0 +1,161 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC 
+# MAGIC ### Top Customers
+# MAGIC 
+# MAGIC Maintains `gold_top_customers` (total spend per store and customer) and `gold_store_leaderboard` (top customers per store) incrementally from the Change Data Feed of `silver_sale_items`.
+# MAGIC 
+# MAGIC The leaderboard only keeps `top_customers_k + top_customers_slack` candidates per store. As long as spend only grows, a customer can only enter the top of a store when their own spend changed, so new candidates are the current candidates plus the customers touched by new sales. Stores with a negative spend change (e.g. removed items) are recomputed from `gold_top_customers`.
+# MAGIC 
+# MAGIC Plans and runtime metrics of the gold queries are recorded with `Utils/Query-Profiles`.
+# MAGIC 
+# MAGIC Spend is aggregated and merged on the integer `sale_key` and `customer_key` (see `Utils/Surrogate-Keys`).
+# MAGIC 
+# MAGIC Requires `table_version` from `Utils/Provisioning`.
+
+# COMMAND ----------
+
+# MAGIC %run ./Table-Changes
+
+# COMMAND ----------
+
+# MAGIC %run ./Query-Profiles
+
+# COMMAND ----------
+
+# MAGIC %run ./Stage-Tuning
+
+# COMMAND ----------
+
+import pyspark.sql.functions as F
+from pyspark.sql.window import Window
+
+top_customers_k = 3
+top_customers_slack = 2
+
+leaderboard_table = "gold_store_leaderboard"
+leaderboard_columns = ["store_id", "customer_key", "unique_customer_id", "customer_name", "customer_spend"]
+
+
+def build_gold_top_customers():
+    # aggregate on the integer keys, names are only joined to the aggregated rows
+    profiled_sql("gold_top_customers", f"""
+    create or replace table gold_top_customers
+    {tblproperties_clause("gold_top_customers")}
+    as
+    with customer_spend as (
+      select s.store_id, ss.customer_key, sum(product_cost) total_spend
+      from silver_sale_items s
+        join silver_sales ss on s.sale_key = ss.sale_key
+      where ss.customer_key is not null
+      group by s.store_id, ss.customer_key
+    )
+    select cs.store_id, cs.customer_key, k.natural_key as unique_customer_id, c.name, cs.total_spend
+    from customer_spend cs
+      join customer_keys k on cs.customer_key = k.customer_key
+      join dim_customers c on k.natural_key = c.unique_id
+    """)
+
+
+def _customer_totals():
+    return spark.table("gold_top_customers") \
+      .select("store_id", "customer_key", "unique_customer_id", F.col("name").alias("customer_name"), F.col("total_spend").alias("customer_spend"))
+
+# COMMAND ----------
+
+def _leaderboard_properties():
+    if not spark.catalog.tableExists(leaderboard_table):
+        return {}
+    return spark.sql(f"DESCRIBE DETAIL {leaderboard_table}").first().properties
+
+
+def _write_leaderboard(candidates, source_version, depth):
+    customer_rank = F.rank().over(Window.partitionBy("store_id").orderBy(F.desc("customer_spend")))
+
+    ranked = candidates \
+      .withColumn("customer_rank", customer_rank) \
+      .where(F.col("customer_rank") <= depth)
+    ranked.createOrReplaceTempView("leaderboard_ranked")
+
+    profile_query(
+        leaderboard_table,
+        lambda: ranked.write.mode("overwrite").option("overwriteSchema", "true").saveAsTable(leaderboard_table),
+        plan_sql="select * from leaderboard_ranked",
+    )
+
+    spark.sql(f"""
+    ALTER TABLE {leaderboard_table} SET TBLPROPERTIES (
+      'apjuice.leaderboard.sourceVersion' = '{source_version}',
+      'apjuice.leaderboard.depth' = '{depth}'
+    )
+    """)
+
+
+def _spend_deltas(from_version, to_version):
+    sign = F.when(F.col("_change_type").isin("insert", "update_postimage"), 1).otherwise(-1)
+
+    return changes("silver_sale_items", from_version, to_version) \
+      .join(spark.table("silver_sales").select("sale_key", "customer_key"), "sale_key") \
+      .where(F.col("customer_key").isNotNull()) \
+      .groupBy("store_id", "customer_key") \
+      .agg(F.sum(sign * F.col("product_cost")).alias("spend_delta"))
+
+# COMMAND ----------
+
+def update_top_customers(k=top_customers_k):
+    depth = k + top_customers_slack
+    current_version = table_version("silver_sale_items")
+
+    properties = _leaderboard_properties()
+    last_version = int(properties.get("apjuice.leaderboard.sourceVersion", -1))
+
+    # silver_sale_items was recreated, depth changed or there is no leaderboard yet
+    if last_version < 0 or last_version > current_version or int(properties.get("apjuice.leaderboard.depth", 0)) != depth:
+        build_gold_top_customers()
+        _write_leaderboard(_customer_totals(), current_version, depth)
+        print(f"{leaderboard_table}: rebuilt at silver_sale_items version {current_version}")
+        return
+
+    if last_version == current_version:
+        print(f"{leaderboard_table}: up to date")
+        return
+
+    deltas = _spend_deltas(last_version, current_version).cache()
+    deltas.createOrReplaceTempView("top_customers_spend_deltas")
+
+    spark.sql("""
+    merge into gold_top_customers target
+      using (
+        select d.store_id, d.customer_key, k.natural_key as unique_customer_id, c.name, d.spend_delta
+        from top_customers_spend_deltas d
+          join customer_keys k on d.customer_key = k.customer_key
+          join dim_customers c on k.natural_key = c.unique_id
+      ) source
+      on target.store_id = source.store_id and target.customer_key = source.customer_key
+    when matched then
+      update set total_spend = target.total_spend + source.spend_delta
+    when not matched then
+      insert (store_id, customer_key, unique_customer_id, name, total_spend) values (source.store_id, source.customer_key, source.unique_customer_id, source.name, source.spend_delta)
+    """)
+
+    refill_stores = [r.store_id for r in deltas.where(F.col("spend_delta") < 0).select("store_id").distinct().collect()]
+    touched_keys = deltas.select("store_id", "customer_key")
+
+    current_candidates = spark.table(leaderboard_table).select(*leaderboard_columns) \
+      .join(touched_keys, ["store_id", "customer_key"], "left_anti")
+    touched_candidates = _customer_totals().join(touched_keys, ["store_id", "customer_key"], "left_semi")
+
+    candidates = current_candidates.unionByName(touched_candidates) \
+      .where(~F.col("store_id").isin(refill_stores)) \
+      .unionByName(_customer_totals().where(F.col("store_id").isin(refill_stores)))
+
+    _write_leaderboard(candidates, current_version, depth)
+    deltas.unpersist()
+    print(f"{leaderboard_table}: updated from silver_sale_items versions {last_version + 1}-{current_version}")
+
+
+def top_customers(k=top_customers_k, store_id=None):
+    leaderboard = spark.table(leaderboard_table).where(F.col("customer_rank") <= k)
+    if store_id is not None:
+        leaderboard = leaderboard.where(F.col("store_id") == store_id)
+    return leaderboard.orderBy("store_id", "customer_rank")